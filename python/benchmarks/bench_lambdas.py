@@ -0,0 +1,397 @@
+'''
+Offline benchmark for the local SEO photo Lambdas.
+
+Drives lambda_handler in local-seo-save-photos-to-s3.py and
+local-seo-google-business-upload-corrected.py against moto's in-process S3,
+SQS and DynamoDB, with a local HTTP stub standing in for the
+mybusiness.googleapis.com media endpoint. Nothing leaves the machine.
+
+Requirements (not needed by the Lambdas themselves):
+pip install boto3 moto google-auth requests
+
+Usage:
+python python/benchmarks/bench_lambdas.py --output bench.json
+python python/benchmarks/bench_lambdas.py --batch-sizes 10 --image-kb 500 --gbp-error-rate 0.2
+python python/benchmarks/bench_lambdas.py --output after.json --compare before.json
+'''
+import argparse
+import base64
+import importlib.util
+import json
+import os
+import random
+import statistics
+import struct
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+
+PYTHON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAVE_LAMBDA = 'local-seo-save-photos-to-s3'
+UPLOAD_LAMBDA = 'local-seo-google-business-upload-corrected'
+REGION = 'us-east-1'
+
+# The Lambdas read these at import time; quiet logs and EMF so they don't skew timings
+os.environ.setdefault('AWS_DEFAULT_REGION', REGION)
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+os.environ.setdefault('DC_GOOGLE_ID', '1000000000000000001')
+os.environ.setdefault('TOWSON_GOOGLE_ID', '1000000000000000002')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+os.environ.setdefault('METRICS_ENABLED', 'false')
+sys.path.insert(0, PYTHON_DIR)
+
+import boto3
+import requests
+from moto import mock_aws
+from moto.core.botocore_stubber import BotocoreStubber
+
+import localseo_aws
+
+# moto's backends are not thread-safe (concurrent TransactWriteItems corrupt table
+# state), so requests into the stand-in are serialized. Simulated network latency
+# is added outside this lock so concurrent handlers still overlap their waits.
+_moto_lock = threading.Lock()
+_moto_process_request = BotocoreStubber.process_request
+
+def _serialized_process_request(self, request):
+    with _moto_lock:
+        return _moto_process_request(self, request)
+
+BotocoreStubber.process_request = _serialized_process_request
+
+class GbpStub:
+    """Local stand-in for the GBP media endpoint with configurable latency and error rate"""
+
+    def __init__(self, latency_ms=0, error_rate=0.0, error_status=500):
+        self.latency_ms = latency_ms
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), self._handler())
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self._server.server_port}/v4"
+
+    def _handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                with stub._lock:
+                    stub.requests += 1
+                if stub.latency_ms:
+                    time.sleep(stub.latency_ms / 1000)
+                if random.random() < stub.error_rate:
+                    status, body = stub.error_status, {"error": {"code": stub.error_status}}
+                else:
+                    status, body = 200, {"name": f"media/{uuid.uuid4()}", "mediaFormat": "PHOTO"}
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._server.shutdown()
+        self._server.server_close()
+
+class StubCredentials:
+    """Credentials that never expire, so the session cache never fetches a real token"""
+    token = 'benchmark-token'
+    expiry = datetime(2100, 1, 1)
+
+    def refresh(self, request):
+        pass
+
+class AwsCallCounter:
+    """Count botocore API calls made by the Lambda's clients and add simulated round-trip latency"""
+
+    def __init__(self, latency_ms=0):
+        self.latency_ms = latency_ms
+        self.calls = {}
+        self._lock = threading.Lock()
+
+    def attach(self, client):
+        client.meta.events.register('before-call.*.*', self._on_call)
+
+    def _on_call(self, model, **kwargs):
+        name = f"{model.service_model.service_name}.{model.name}"
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        if self.latency_ms:
+            time.sleep(self.latency_ms / 1000)
+
+    def reset(self):
+        with self._lock:
+            self.calls = {}
+
+def load_lambda(name):
+    # Each scenario gets fresh clients (and call counters) inside its own moto context
+    localseo_aws.reset_clients()
+    spec = importlib.util.spec_from_file_location(name.replace('-', '_'), os.path.join(PYTHON_DIR, f"{name}.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def lambda_clients():
+    """Build the shared lazily-constructed clients so call counters can be attached up front"""
+    return [localseo_aws.get_client(name) for name in ('s3', 'sqs', 'dynamodb')]
+
+def create_resources(bucket, queue_name, table):
+    boto3.client('s3').create_bucket(Bucket=bucket)
+    queue_url = boto3.client('sqs').create_queue(QueueName=queue_name)['QueueUrl']
+    boto3.client('dynamodb').create_table(
+        TableName=table,
+        KeySchema=[
+            {'AttributeName': 'PK', 'KeyType': 'HASH'},
+            {'AttributeName': 'SK', 'KeyType': 'RANGE'}
+        ],
+        AttributeDefinitions=[
+            {'AttributeName': 'PK', 'AttributeType': 'S'},
+            {'AttributeName': 'SK', 'AttributeType': 'S'}
+        ],
+        BillingMode='PAY_PER_REQUEST'
+    )
+    return queue_url
+
+def percentile(values, pct):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+def summarize(latencies_ms, elapsed, records, aws_calls, peak_bytes):
+    return {
+        "records": records,
+        "elapsed_s": round(elapsed, 4),
+        "throughput_rps": round(records / elapsed, 2) if elapsed else None,
+        "latency_ms": {
+            "p50": round(percentile(latencies_ms, 50), 3) if latencies_ms else None,
+            "p95": round(percentile(latencies_ms, 95), 3) if latencies_ms else None,
+            "p99": round(percentile(latencies_ms, 99), 3) if latencies_ms else None,
+            "mean": round(statistics.fmean(latencies_ms), 3) if latencies_ms else None
+        },
+        "peak_memory_mb": round(peak_bytes / (1024 * 1024), 3),
+        "aws_calls_per_record": {
+            name: round(total / records, 3) for name, total in sorted(aws_calls.items())
+        } if records else {}
+    }
+
+def make_image(size_bytes, width=1024, height=768):
+    # SOI and a baseline SOF0 header followed by filler: enough for the save Lambda's header checks
+    header = b'\xff\xd8\xff\xc0' + struct.pack('>HBHHB', 11, 8, height, width, 1) + b'\x01\x11\x00'
+    return header + os.urandom(max(0, size_bytes - len(header)))
+
+def bench_save(args, image_kb):
+    """Invoke the save Lambda once per photo and measure each invocation"""
+    with mock_aws():
+        save = load_lambda(SAVE_LAMBDA)
+        create_resources(save.BUCKET_NAME, 'LocalSEOMediaQueue', save.DYNAMODB_TABLE)
+        counter = AwsCallCounter(args.aws_latency_ms)
+        for client in lambda_clients():
+            counter.attach(client)
+
+        total = args.save_invocations
+        latencies = []
+
+        tracemalloc.start()
+        start = time.perf_counter()
+        for index in range(total):
+            # Fresh bytes per photo, otherwise every repeat is skipped as a duplicate
+            payload = base64.b64encode(make_image(image_kb * 1024)).decode()
+            event = {
+                "fileName": f"bench-{index}.jpg",
+                "fileContent": payload,
+                "contentType": "image/jpeg",
+                "storeId": random.choice(args.stores)
+            }
+            record_start = time.perf_counter()
+            response = save.lambda_handler(event, SimpleNamespace(aws_request_id=str(uuid.uuid4())))
+            latencies.append((time.perf_counter() - record_start) * 1000)
+            if response.get('statusCode') != 200:
+                raise RuntimeError(f"Save Lambda failed: {response}")
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        return summarize(latencies, elapsed, total, counter.calls, peak)
+
+def seed_upload_batch(save, batch_size, image_kb, stores):
+    """Put objects and PENDING records in place and build the matching SQS records"""
+    s3 = boto3.client('s3')
+    dynamodb = boto3.client('dynamodb')
+    image = make_image(image_kb * 1024)
+    records = []
+    for index in range(batch_size):
+        store_id = random.choice(stores)
+        file_name = f"bench-{uuid.uuid4().hex[:8]}-{index}.jpg"
+        file_key = save.generate_file_key(store_id, file_name)
+        uploaded_at = (datetime.now() + timedelta(microseconds=index)).isoformat()
+        s3.put_object(Bucket=save.BUCKET_NAME, Key=file_key, Body=image, ContentType='image/jpeg')
+        dynamodb.put_item(
+            TableName=save.DYNAMODB_TABLE,
+            Item={
+                'PK': {'S': save.photo_partition_key(store_id)},
+                'SK': {'S': save.photo_sort_key('PENDING', uploaded_at, file_name)},
+                'fileName': {'S': file_name},
+                'fileKey': {'S': file_key},
+                'uploadTimestamp': {'S': uploaded_at},
+                'status': {'S': 'PENDING'}
+            }
+        )
+        body = {
+            "fileKey": file_key,
+            "fileName": file_name,
+            "storeId": store_id,
+            "contentType": "image/jpeg",
+            "uploadedAt": uploaded_at,
+            "fileSize": len(image)
+        }
+        records.append({
+            "messageId": str(uuid.uuid4()),
+            "receiptHandle": uuid.uuid4().hex,
+            "body": json.dumps(body),
+            "attributes": {"ApproximateReceiveCount": "1"},
+            "messageAttributes": {"storeId": {"stringValue": store_id, "dataType": "String"}}
+        })
+    return records
+
+def bench_upload(args, batch_size, image_kb, error_rate):
+    """Invoke the upload Lambda with SQS-shaped batches and measure each record"""
+    with mock_aws(), GbpStub(args.gbp_latency_ms, error_rate, args.gbp_error_status) as stub:
+        save = load_lambda(SAVE_LAMBDA)
+        upload = load_lambda(UPLOAD_LAMBDA)
+        create_resources(save.BUCKET_NAME, 'LocalSEOMediaQueue', save.DYNAMODB_TABLE)
+
+        # Point the Lambda at the stub and skip the service-account token fetch
+        upload.GBP_API_BASE = stub.base_url
+        upload._gbp_session_cache.update({
+            "credentials": StubCredentials(),
+            "session": requests.Session()
+        })
+
+        counter = AwsCallCounter(args.aws_latency_ms)
+        for client in lambda_clients():
+            counter.attach(client)
+
+        record_latencies = []
+        latency_lock = threading.Lock()
+        process_message = upload.process_message
+
+        def timed_process_message(*call_args, **call_kwargs):
+            record_start = time.perf_counter()
+            try:
+                return process_message(*call_args, **call_kwargs)
+            finally:
+                with latency_lock:
+                    record_latencies.append((time.perf_counter() - record_start) * 1000)
+
+        upload.process_message = timed_process_message
+
+        batches = [
+            seed_upload_batch(save, batch_size, image_kb, args.stores)
+            for _ in range(args.batches)
+        ]
+        counter.reset()
+
+        failed = 0
+        tracemalloc.start()
+        start = time.perf_counter()
+        for records in batches:
+            response = upload.lambda_handler({"Records": records}, SimpleNamespace(aws_request_id=str(uuid.uuid4())))
+            failed += len(response.get('batchItemFailures', []))
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        summary = summarize(record_latencies, elapsed, batch_size * args.batches, counter.calls, peak)
+        summary["failed_records"] = failed
+        summary["gbp_requests"] = stub.requests
+        return summary
+
+def compare(current, baseline):
+    """Print throughput and p95 deltas against a previous run"""
+    previous = {scenario["name"]: scenario for scenario in baseline.get("scenarios", [])}
+    for scenario in current["scenarios"]:
+        before = previous.get(scenario["name"])
+        if not before:
+            continue
+        now, then = scenario["result"], before["result"]
+        print(
+            f"{scenario['name']}: throughput {then['throughput_rps']} -> {now['throughput_rps']} rps, "
+            f"p95 {then['latency_ms']['p95']} -> {now['latency_ms']['p95']} ms"
+        )
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 10])
+    parser.add_argument('--batches', type=int, default=3, help='Upload Lambda invocations per scenario')
+    parser.add_argument('--image-kb', type=int, nargs='+', default=[100, 2048])
+    parser.add_argument('--gbp-error-rate', type=float, nargs='+', default=[0.0, 0.2])
+    parser.add_argument('--gbp-error-status', type=int, default=500)
+    parser.add_argument('--gbp-latency-ms', type=float, default=150)
+    parser.add_argument('--aws-latency-ms', type=float, default=10, help='Simulated round trip per AWS call')
+    parser.add_argument('--save-invocations', type=int, default=20)
+    parser.add_argument('--stores', nargs='+', default=['dc', 'towson'])
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--only', choices=['save', 'upload'])
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    parser.add_argument('--compare', help='Previous JSON results to compare against')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    random.seed(args.seed)
+    results = {
+        "started_at": datetime.now().isoformat(),
+        "config": vars(args),
+        "scenarios": []
+    }
+
+    if args.only in (None, 'save'):
+        for image_kb in args.image_kb:
+            name = f"save/image={image_kb}KB"
+            results["scenarios"].append({"name": name, "result": bench_save(args, image_kb)})
+            print(f"{name}: {json.dumps(results['scenarios'][-1]['result']['latency_ms'])}")
+
+    if args.only in (None, 'upload'):
+        for batch_size in args.batch_sizes:
+            for image_kb in args.image_kb:
+                for error_rate in args.gbp_error_rate:
+                    name = f"upload/batch={batch_size}/image={image_kb}KB/errors={error_rate}"
+                    result = bench_upload(args, batch_size, image_kb, error_rate)
+                    results["scenarios"].append({"name": name, "result": result})
+                    print(f"{name}: {json.dumps(result['latency_ms'])}")
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+        print(f"Results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as baseline:
+            compare(results, json.load(baseline))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,192 @@
+'''
+Burst-write benchmark for write-sharded photo records (PHOTO_SHARDS).
+
+Replays a burst of uploads for a single store against moto's DynamoDB: each
+photo's PENDING record is written with the save Lambda's create_dynamodb_record
+and then moved to COMPLETED with the upload Lambda's update_dynamodb_record,
+from many threads at once. moto has no partitions, so a write budget per
+partition key is enforced in front of it: a write waits until its partition
+has capacity, the way a throttled request waits out SDK backoff. Transactional
+writes cost two units per item, as in DynamoDB. Each scenario also times the
+first page of the photo-status API, which scatter-gathers across the shards.
+
+DynamoDB accepts about 1000 write units per second per partition; moto itself
+manages only a few hundred calls per second, so the default budget is scaled
+down to keep the partition model, not moto, the limit in the unsharded case.
+The status page timings are serialized by moto, so read them as query counts.
+
+Requirements (not needed by the Lambdas themselves):
+pip install boto3 moto
+
+Usage:
+python python/benchmarks/bench_sharding.py
+python python/benchmarks/bench_sharding.py --photos 2000 --shards 1 4 16 --output sharding.json
+'''
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# Sets up the environment, sys.path and the serialized moto backend
+from bench_lambdas import SAVE_LAMBDA, UPLOAD_LAMBDA, create_resources, load_lambda, percentile
+
+from moto import mock_aws
+
+import localseo_aws
+
+STATUS_LAMBDA = 'local-seo-photo-status'
+
+class PartitionBudget:
+    """Per-partition-key token buckets that hold DynamoDB writes until their partition has capacity"""
+
+    def __init__(self, units_per_second):
+        self.rate = units_per_second
+        self.buckets = {}
+        self.units = {}
+        self.wait_s = 0.0
+        self._lock = threading.Lock()
+
+    def attach(self, client):
+        client.meta.events.register('before-parameter-build.dynamodb.*', self._on_call)
+
+    def _on_call(self, params, model, **kwargs):
+        for partition_key, units in self._write_units(model.name, params):
+            self._acquire(partition_key, units)
+
+    @staticmethod
+    def _write_units(operation, params):
+        if operation in ('PutItem', 'UpdateItem', 'DeleteItem'):
+            item = params.get('Item') or params.get('Key')
+            return [(item['PK']['S'], 1)]
+        if operation == 'TransactWriteItems':
+            units = []
+            for entry in params['TransactItems']:
+                action = next(iter(entry.values()))
+                units.append(((action.get('Item') or action['Key'])['PK']['S'], 2))
+            return units
+        if operation == 'BatchWriteItem':
+            units = []
+            for requests in params['RequestItems'].values():
+                for request in requests:
+                    action = request.get('PutRequest') or request.get('DeleteRequest')
+                    units.append(((action.get('Item') or action['Key'])['PK']['S'], 1))
+            return units
+        return []
+
+    def _acquire(self, partition_key, units):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                tokens, updated = self.buckets.get(partition_key, (self.rate, now))
+                tokens = min(self.rate, tokens + (now - updated) * self.rate)
+                if tokens >= units:
+                    self.buckets[partition_key] = (tokens - units, now)
+                    self.units[partition_key] = self.units.get(partition_key, 0) + units
+                    return
+                self.buckets[partition_key] = (tokens, now)
+                wait = (units - tokens) / self.rate
+                self.wait_s += wait
+            time.sleep(wait)
+
+def bench_burst(args, shards):
+    """Write and complete args.photos records for one store with PHOTO_SHARDS=shards"""
+    localseo_aws.PHOTO_SHARDS = shards
+    with mock_aws():
+        save = load_lambda(SAVE_LAMBDA)
+        upload = load_lambda(UPLOAD_LAMBDA)
+        status = load_lambda(STATUS_LAMBDA)
+        create_resources(save.BUCKET_NAME, 'LocalSEOMediaQueue', save.DYNAMODB_TABLE)
+        budget = PartitionBudget(args.partition_wcu)
+        budget.attach(localseo_aws.get_client('dynamodb'))
+
+        base_time = datetime.now()
+        latencies = []
+        latency_lock = threading.Lock()
+
+        def write_photo(index):
+            file_name = f"burst-{index}.jpg"
+            file_key = save.generate_file_key(args.store, file_name)
+            record_start = time.perf_counter()
+            uploaded_at, _ = save.create_dynamodb_record(
+                args.store, file_name, file_key, (base_time + timedelta(microseconds=index)).isoformat()
+            )
+            written = upload.update_dynamodb_record(
+                args.store, file_name, uploaded_at, 'COMPLETED', result={'success': True}, file_key=file_key,
+                partition_key=localseo_aws.photo_partition_key(args.store, file_key)
+            )
+            if not written:
+                raise RuntimeError(f"PENDING record for {file_name} not found")
+            with latency_lock:
+                latencies.append((time.perf_counter() - record_start) * 1000)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            list(pool.map(write_photo, range(args.photos)))
+        elapsed = time.perf_counter() - start
+
+        read_latencies = []
+        for _ in range(args.reads):
+            read_start = time.perf_counter()
+            page = status.list_photos(args.store, status.STATUSES, limit=25)
+            read_latencies.append((time.perf_counter() - read_start) * 1000)
+        if len(page["photos"]) != min(25, args.photos):
+            raise RuntimeError(f"Status page returned {len(page['photos'])} photos")
+
+        return {
+            "shards": shards,
+            "photos": args.photos,
+            "elapsed_s": round(elapsed, 4),
+            "throughput_photos_per_s": round(args.photos / elapsed, 2),
+            "latency_ms": {
+                "p50": round(percentile(latencies, 50), 3),
+                "p95": round(percentile(latencies, 95), 3),
+                "p99": round(percentile(latencies, 99), 3)
+            },
+            "partition_wait_s": round(budget.wait_s, 3),
+            "hottest_partition_units": max(budget.units.values()),
+            "partitions_written": len(budget.units),
+            "status_page_ms": round(statistics.fmean(read_latencies), 3),
+            "status_page_queries": len(status.STATUSES) * len(localseo_aws.photo_partition_keys(args.store))
+        }
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--photos', type=int, default=200, help='Photos in the burst, all for one store')
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 4, 16])
+    parser.add_argument('--concurrency', type=int, default=32, help='Writers in flight')
+    parser.add_argument('--partition-wcu', type=float, default=50, help='Write units per second per partition')
+    parser.add_argument('--reads', type=int, default=20, help='Status pages timed after each burst')
+    parser.add_argument('--store', default='dc')
+    parser.add_argument('--output', help='Write results as JSON to this path')
+    return parser.parse_args()
+
+def main():
+    args = parse_args()
+    results = {
+        "started_at": datetime.now().isoformat(),
+        "config": vars(args),
+        "scenarios": []
+    }
+    for shards in args.shards:
+        result = bench_burst(args, shards)
+        results["scenarios"].append({"name": f"burst/shards={shards}", "result": result})
+        print(
+            f"shards={shards}: {result['throughput_photos_per_s']} photos/s, "
+            f"p95 {result['latency_ms']['p95']} ms, partition wait {result['partition_wait_s']} s, "
+            f"status page {result['status_page_ms']} ms ({result['status_page_queries']} queries)"
+        )
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+        print(f"Results written to {args.output}")
+
+if __name__ == '__main__':
+    main()
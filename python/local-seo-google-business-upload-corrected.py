@@ -2,47 +2,126 @@
 # SQS Trigger Lambda
 # SQS: LocalSEOMediaQueue
 # arn:aws:sqs:us-east-1:752567131183:LocalSEOMediaQueue
-import json
-import boto3
-import os
 import time
-import logging
-from google.oauth2 import service_account
-import google.auth.transport.requests
-from botocore.exceptions import ClientError
-from datetime import datetime
+_init_started = time.perf_counter()
 
-# Configure logging
-logger = logging.getLogger()
-logger.setLevel(logging.INFO)
+import json
+import mimetypes
+import os
+import random
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import BotoCoreError, ClientError
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from localseo_aws import (
+    BUCKET_NAME, DIRECT_UPLOADS_FOLDER, DYNAMODB_TABLE, ERRORS_FOLDER, MAX_RETRIES, PROCESSED_FOLDER, QUEUE_URL,
+    RETRY_DELAY, UPLOADS_FOLDER, configure_clients, content_index_key, get_client, parse_file_key,
+    photo_partition_key, photo_partition_keys, photo_sort_key, retry_with_backoff, startup_report, timed_init
+)
+from localseo_logging import log_with_context
+from localseo_metrics import MetricsRecorder, bind, count, current_metrics, set_dimension, timer
 
 # Constants
-BUCKET_NAME = "street-lawyer-services"
-PROCESSED_FOLDER = "local-seo-photos/processed"
-ERRORS_FOLDER = "local-seo-photos/errors"
-QUEUE_URL = "https://sqs.us-east-1.amazonaws.com/752567131183/LocalSEOMediaQueue"
 GBP_API_BASE = "https://mybusiness.googleapis.com/v4"
+GBP_ACCOUNT_ID = os.environ.get('GBP_ACCOUNT_ID', "106507314990610040138")  # Default for registry entries without accountId
 GBP_SERVICE_ACCOUNT_KEY = 'sls_gbp_key.json'
-MAX_RETRIES = 3
-RETRY_DELAY = 2  # Initial retry delay in seconds
+METRICS_SERVICE = "gbp-upload"
 UPLOAD_TIMEOUT = 30  # Timeout for upload requests in seconds
+MAX_CONCURRENCY = int(os.environ.get('MAX_CONCURRENCY', '10'))  # Records processed in parallel, 1 = sequential
+DELETE_BATCH_SIZE = 1000  # DeleteObjects key limit
+TOKEN_REFRESH_MARGIN = 300  # Refresh the GBP access token this many seconds before expiry
+IDEMPOTENCY_CACHE_SIZE = 1024  # Upload states kept in memory per warm container
+IDEMPOTENCY_TTL = 14 * 24 * 3600  # Idempotency items expire via the table's expiresAt TTL
+# COMPLETED records expire through the same TTL so store partitions stay small; 0 keeps them
+COMPLETED_RECORD_TTL = int(os.environ.get('COMPLETED_RECORD_TTL_DAYS', '90')) * 24 * 3600
+LOCATION_REGISTRY_PK = "LOCATION"  # Registry partition: one item per store, SK = storeId
+LOCATION_CACHE_TTL = int(os.environ.get('LOCATION_CACHE_TTL', '300'))  # Seconds a loaded registry is reused
+LOCATION_MISS_REFRESH = 30  # Unknown stores reload the registry at most this often, in seconds
+FANOUT_CONCURRENCY = int(os.environ.get('FANOUT_CONCURRENCY', '8'))  # GBP calls in flight per fan-out message
+REPROCESS_CONCURRENCY = int(os.environ.get('REPROCESS_CONCURRENCY', '8'))  # Error photos re-driven in parallel
+REPROCESS_CHUNK_SIZE = 100  # Error objects handled between checkpoints
+REPROCESS_TIME_MARGIN = 60  # Seconds of invocation time left when a reprocess run checkpoints and stops
+REPROCESS_CHECKPOINT_PK = "REPROCESS#CHECKPOINT"  # One item per run scope, SK = storeId or "ALL"
 
-# Image validation constants
-MAX_IMAGE_SIZE = 5 * 1024 * 1024  # 5MB
-MIN_IMAGE_SIZE = 10 * 1024  # 10KB
-VALID_CONTENT_TYPES = ['image/jpeg', 'image/png']
+# Record (or reprocess) workers and fan-out workers all make AWS calls, so each needs a pooled connection
+configure_clients(max_pool_connections=max(MAX_CONCURRENCY, REPROCESS_CONCURRENCY) + FANOUT_CONCURRENCY)
 
-# Location Configurations
-LOCATION_CONFIG = {
-    "dc": os.environ['DC_GOOGLE_ID'],
-    "towson": os.environ['TOWSON_GOOGLE_ID']
+# GBP rate limiting, per account and location
+GBP_RATE_LIMIT = float(os.environ.get('GBP_RATE_LIMIT', '5'))  # Max requests per second
+GBP_RATE_BURST = float(os.environ.get('GBP_RATE_BURST', '5'))  # Bucket capacity
+GBP_MIN_RATE = 0.2  # Floor the adaptive rate never drops below
+GBP_RATE_DECREASE = 0.5  # Rate multiplier applied after a 429
+GBP_RATE_INCREASE = 0.1  # Requests per second regained after each success
+GBP_MAX_BACKOFF = 16  # Cap on a single jittered backoff in seconds
+GBP_MAX_RETRY_AFTER = 30  # Longer Retry-After values fail the record instead of waiting
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+# GBP circuit breaker, shared by every container through one DynamoDB item
+CIRCUIT_KEY = {'PK': {'S': "GBP#CIRCUIT"}, 'SK': {'S': "STATE"}}
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD', '5'))  # Consecutive outage failures that open it
+CIRCUIT_OPEN_SECONDS = 60  # First open period; doubles after each failed probe
+CIRCUIT_MAX_OPEN_SECONDS = 900  # Cap on a single open period
+CIRCUIT_PROBE_INTERVAL = 10  # Once the open period ends, one probe request per this many seconds
+CIRCUIT_REFRESH = 5  # Seconds a container reuses the shared state before reading it again
+# A deferral counts as a receive, so maxReceiveCount must outlast an outage before the redrive applies
+DEFER_BASE_DELAY = 30  # Visibility delay for a message deferred on its first receive, in seconds
+DEFER_MAX_DELAY = 900  # Cap on the deferral delay, in seconds
+VISIBILITY_BATCH_SIZE = 10  # ChangeMessageVisibilityBatch entry limit
+
+# Fallback for stores not yet in the DynamoDB location registry: store ID -> environment
+# variable holding its GBP location ID. Read per lookup so a missing variable fails that
+# record instead of the module import.
+LOCATION_ENV_VARS = {
+    "dc": "DC_GOOGLE_ID",
+    "towson": "TOWSON_GOOGLE_ID"
 }
 
-aws_clients = {
-    "s3": boto3.client("s3"),
-    "sqs": boto3.client("sqs"),
-    "dynamodb": boto3.client("dynamodb")
+# Location registry loaded from DynamoDB, reused for LOCATION_CACHE_TTL by warm invocations
+_location_cache = {
+    "locations": None,
+    "loaded_at": 0.0
 }
+_location_lock = threading.Lock()
+
+# Pool for the GBP calls of fan-out messages, created on first use
+_fanout_pool = None
+_fanout_pool_lock = threading.Lock()
+
+# google-auth modules, imported on first authentication
+_google_modules = None
+
+# Cleared after the first invocation logs the startup report
+_cold_start = True
+
+# Token buckets keyed by account/location, shared by worker threads and warm invocations
+_gbp_limiters = {}
+_gbp_limiters_lock = threading.Lock()
+
+# Authenticated GBP session, reused by every record in a batch and by warm invocations
+_gbp_session_cache = {
+    "credentials": None,
+    "auth_request": None,
+    "session": None,
+    "hits": 0,
+    "misses": 0
+}
+_gbp_session_lock = threading.Lock()
+
+class CircuitOpenError(Exception):
+    """GBP is treated as down; the message is returned to the queue instead of being failed"""
+
+    def __init__(self, retry_after):
+        super().__init__(f"GBP circuit breaker open, retry in {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+class PhotoFailedError(Exception):
+    """The message failed for good, so it is acknowledged instead of being returned to the queue"""
+
+    def __init__(self, error):
+        super().__init__(str(error))
+        self.error = error
 
 class MediaCategory:
     """Valid Google Business Profile media categories"""
@@ -61,124 +140,245 @@ class MediaCategory:
     TEAMS = "TEAMS"
     ADDITIONAL = "ADDITIONAL"
 
-def log_with_context(message, context=None, level="info", error=None, request_id=None):
-    """Enhanced structured logging with context and error details"""
-    log_data = {
-        "message": message,
-        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
-        "context": context or {},
-        "error": {
-            "message": str(error) if error else None,
-            "type": error.__class__.__name__ if error else None
-        },
-        "request_id": request_id
+def _google_auth():
+    """Import google-auth on first use instead of at module import"""
+    global _google_modules
+    if _google_modules is None:
+        with timed_init("google_auth_import"):
+            from google.oauth2 import service_account
+            import google.auth.transport.requests
+        _google_modules = (service_account, google.auth.transport.requests)
+    return _google_modules
+
+def load_location_registry():
+    """Read every registry item: {storeId: {'account_id', 'location_id', 'enabled'}}"""
+    locations = {}
+    kwargs = {
+        'TableName': DYNAMODB_TABLE,
+        'KeyConditionExpression': 'PK = :pk',
+        'ExpressionAttributeValues': {':pk': {'S': LOCATION_REGISTRY_PK}}
     }
-    
-    if level == "error":
-        logger.error(json.dumps(log_data))
-    else:
-        logger.info(json.dumps(log_data))
+    with timer('LocationRegistryLoad'):
+        while True:
+            response = retry_with_backoff(get_client("dynamodb").query, **kwargs)
+            for item in response.get('Items', []):
+                # Disabled stores stay in the registry so they are refused, not sent to the env fallback
+                locations[item['SK']['S']] = {
+                    'account_id': item.get('accountId', {}).get('S', GBP_ACCOUNT_ID),
+                    'location_id': item['locationId']['S'],
+                    'enabled': item.get('enabled', {}).get('BOOL', True)
+                }
+            if 'LastEvaluatedKey' not in response:
+                return locations
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
 
-def validate_image(file_content, content_type):
-    """Validate image size and content type"""
-    if content_type not in VALID_CONTENT_TYPES:
-        raise ValueError(f"Invalid content type: {content_type}")
-    
-    file_size = len(file_content)
-    if file_size > MAX_IMAGE_SIZE:
-        raise ValueError(f"File too large: {file_size} bytes (max {MAX_IMAGE_SIZE} bytes)")
-    if file_size < MIN_IMAGE_SIZE:
-        raise ValueError(f"File too small: {file_size} bytes (min {MIN_IMAGE_SIZE} bytes)")
+def _cached_locations(max_age):
+    """Return the registry, reloading it when older than max_age seconds"""
+    with _location_lock:
+        age = time.monotonic() - _location_cache["loaded_at"]
+        if _location_cache["locations"] is not None and age < max_age:
+            return _location_cache["locations"]
+        try:
+            _location_cache["locations"] = load_location_registry()
+        except (BotoCoreError, ClientError) as e:
+            if _location_cache["locations"] is None:
+                raise
+            # Keep serving the last good registry rather than failing every record
+            log_with_context("Location registry reload failed, using cached copy", level="warning", error=e)
+        _location_cache["loaded_at"] = time.monotonic()
+        return _location_cache["locations"]
+
+def get_location(store_id):
+    """Resolve a store to (account_id, location_id), raising ValueError for unknown, unconfigured or disabled stores"""
+    location = _cached_locations(LOCATION_CACHE_TTL).get(store_id)
+    if location is None:
+        # A store onboarded since the last load; reload, but not on every unknown store
+        location = _cached_locations(LOCATION_MISS_REFRESH).get(store_id)
+    if location is not None:
+        if not location['enabled']:
+            raise ValueError(f"GBP uploads are disabled for {store_id}")
+        return location['account_id'], location['location_id']
+
+    env_var = LOCATION_ENV_VARS.get(store_id)
+    if not env_var:
+        raise ValueError(f"Invalid store ID: {store_id}")
+    location_id = os.environ.get(env_var)
+    if not location_id:
+        raise ValueError(f"No GBP location configured for {store_id}: {env_var} is not set")
+    return GBP_ACCOUNT_ID, location_id
+
+def get_session_cache_stats():
+    """Return hit/miss counters for the cached GBP session"""
+    return {
+        "hits": _gbp_session_cache["hits"],
+        "misses": _gbp_session_cache["misses"]
+    }
+
+def _token_needs_refresh(credentials):
+    """Check whether the access token is missing or about to expire"""
+    if not credentials.token or credentials.expiry is None:
+        return True
+    now = datetime.now(timezone.utc).replace(tzinfo=None)  # google-auth stores naive UTC expiry
+    return (credentials.expiry - now).total_seconds() < TOKEN_REFRESH_MARGIN
 
 def get_authenticated_session():
-    """Get authenticated session with retry logic"""
-    retry_count = 0
-    retry_delay = RETRY_DELAY
-    
-    while retry_count < MAX_RETRIES:
-        try:
-            log_with_context(f"Authentication attempt {retry_count + 1}/{MAX_RETRIES}")
+    """Get the cached authenticated session, refreshing the token shortly before it expires"""
+    with timer('Auth'), _gbp_session_lock:
+        return _get_authenticated_session_locked()
+
+def _get_authenticated_session_locked():
+    """Return the cached session or build/refresh it; caller must hold _gbp_session_lock"""
+    cache = _gbp_session_cache
+    session = cache["session"]
+
+    if session is not None and not _token_needs_refresh(cache["credentials"]):
+        cache["hits"] += 1
+        return session
+
+    cache["misses"] += 1
+    # One attempt, no sleeping: every worker waits on this lock, and a token endpoint
+    # outage is counted by the circuit breaker, which defers messages instead
+    try:
+        service_account, google_transport = _google_auth()
+        credentials = cache["credentials"]
+        if credentials is None:
             credentials = service_account.Credentials.from_service_account_file(
                 GBP_SERVICE_ACCOUNT_KEY,
                 scopes=['https://www.googleapis.com/auth/business.manage']
             )
-            session = google.auth.transport.requests.AuthorizedSession(credentials)
-            log_with_context("Authentication successful")
-            return session
+        if cache["auth_request"] is None:
+            cache["auth_request"] = google_transport.Request()
+
+        # Fetch the token up front so its expiry is known and the first POST does not pay for it
+        credentials.refresh(cache["auth_request"])
+    except Exception as e:
+        log_with_context("Authentication failed", {"cached_session": session is not None}, level="error", error=e)
+        raise
+
+    if session is None:
+        session = google_transport.AuthorizedSession(credentials)
+
+    cache["credentials"] = credentials
+    cache["session"] = session
+    log_with_context("Authentication successful", {
+        "token_expiry": credentials.expiry.isoformat() if credentials.expiry else None
+    })
+    return session
+
+class S3MoveStage:
+    """Copy objects as records finish and delete all sources with bulk DeleteObjects at the end.
+
+    Each queued delete can name the message that owns it; keys still undeleted
+    after the retries are reported through failed_owners, so the handler returns
+    those messages to the queue and the redelivery queues the delete again.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending_deletes = []
+        self._owners = {}
+        self.delete_results = {}
+
+    def move(self, source_key, dest_key, owner=None):
+        """Copy source_key to dest_key now and queue the source for deletion"""
+        self.copy(source_key, dest_key)
+        self.delete_later(source_key, owner)
+
+    def delete_later(self, source_key, owner=None):
+        """Queue a source key for the bulk delete at the end of the invocation"""
+        with self._lock:
+            if source_key not in self._pending_deletes:
+                self._pending_deletes.append(source_key)
+            if owner is not None:
+                self._owners.setdefault(source_key, set()).add(owner)
+
+    def copy(self, source_key, dest_key):
+        """Copy an object without deleting the source, so a retried copy still finds it"""
+        # Photos are capped well below CopyObject's 5GB limit, so a single request always suffices
+        with timer('S3Copy'):
+            retry_with_backoff(
+                get_client("s3").copy_object,
+                Bucket=BUCKET_NAME,
+                CopySource={'Bucket': BUCKET_NAME, 'Key': source_key},
+                Key=dest_key
+            )
+
+    def flush(self):
+        """Delete queued sources in batches, retrying keys that fail; returns per-key results"""
+        with self._lock:
+            pending, self._pending_deletes = self._pending_deletes, []
+
+        for start in range(0, len(pending), DELETE_BATCH_SIZE):
+            remaining = pending[start:start + DELETE_BATCH_SIZE]
+            retry_count = 0
+            retry_delay = RETRY_DELAY
             
-        except Exception as e:
-            retry_count += 1
-            if retry_count == MAX_RETRIES:
-                log_with_context(
-                    "Authentication failed after max retries",
-                    level="error",
-                    error=e
-                )
-                raise
-            time.sleep(retry_delay)
-            retry_delay *= 2
+            while remaining:
+                with timer('S3Delete'):
+                    response = retry_with_backoff(
+                        get_client("s3").delete_objects,
+                        Bucket=BUCKET_NAME,
+                        Delete={'Objects': [{'Key': key} for key in remaining], 'Quiet': True}
+                    )
+                # Quiet mode only lists failures, so everything else was deleted
+                errors = {error['Key']: error.get('Code', 'Unknown') for error in response.get('Errors', [])}
+                for key in remaining:
+                    self.delete_results[key] = errors.get(key, 'Deleted')
 
-def retry_with_backoff(func, *args, **kwargs):
-    """Retry function with exponential backoff"""
-    retry_count = 0
-    retry_delay = RETRY_DELAY
-    
-    while retry_count < MAX_RETRIES:
-        try:
-            return func(*args, **kwargs)
-        except ClientError as e:
-            retry_count += 1
-            if retry_count == MAX_RETRIES:
-                raise
-            time.sleep(retry_delay)
-            retry_delay *= 2
+                remaining = [key for key in remaining if key in errors]
+                retry_count += 1
+                if remaining and retry_count < MAX_RETRIES:
+                    count('Retries')
+                    time.sleep(retry_delay)
+                    retry_delay *= 2
+                elif remaining:
+                    log_with_context("S3 source deletes failed after max retries", {
+                        "failed": {key: errors[key] for key in remaining}
+                    }, level="error")
+                    break
+
+        return self.delete_results
+
+    def failed_owners(self):
+        """Owners of the keys whose deletes failed in flush"""
+        return {
+            owner for key, outcome in self.delete_results.items() if outcome != 'Deleted'
+            for owner in self._owners.get(key, ())
+        }
+
+def _is_conditional_failure(error):
+    """Check whether an AWS error is a failed condition rather than a transient fault"""
+    if not isinstance(error, ClientError):
+        return False
+    code = error.response.get('Error', {}).get('Code')
+    if code == 'ConditionalCheckFailedException':
+        return True
+    if code == 'TransactionCanceledException':
+        reasons = error.response.get('CancellationReasons', [])
+        return any(reason.get('Code') == 'ConditionalCheckFailed' for reason in reasons)
+    return False
 
-def update_dynamodb_record(store_id, file_name, status, result=None, error=None):
-    """Update existing DynamoDB record with the upload status and results"""
+def update_dynamodb_record(store_id, file_name, uploaded_at, status, result=None, error=None, extra_items=None,
+                           content_hash=None, file_key=None, partition_key=None):
+    """Move the PENDING record to its new status in a single transaction.
+
+    partition_key is the record's partition as sent by the save Lambda; messages
+    from before write sharding carry none, and their records are unsharded.
+    extra_items are appended to the same TransactWriteItems call. Returns False
+    when no PENDING record exists, in which case nothing is written.
+    """
     timestamp = datetime.now().isoformat()
     
-    # First, query to find the existing record
-    response = aws_clients["dynamodb"].query(
-        TableName='localseo-photos',
-        KeyConditionExpression='PK = :pk AND begins_with(SK, :sk_prefix)',
-        ExpressionAttributeValues={
-            ':pk': {'S': f"{store_id}#PHOTO"},
-            ':sk_prefix': {'S': f"PENDING#"},
-            ':fileName': {'S': file_name}
-        },
-        FilterExpression='fileName = :fileName'
-    )
-
-    # Debug print statement for DynamoDB query response
-    print(f"DynamoDB query response: {response}")
-    log_with_context("DynamoDB query response", {"response": response})
-
-    if not response.get('Items'):
-        log_with_context(f"No existing record found for {file_name}")
-        return
-
-    existing_record = response['Items'][0]
-    original_sk = existing_record['SK']['S']
-
-    # Update the SK to reflect the new status
-    new_sk = original_sk.replace("PENDING", status)
-    print(f"New SK: {new_sk}")
-
-    # Delete the existing record
-    delete_response = retry_with_backoff(
-        aws_clients["dynamodb"].delete_item,
-        TableName='localseo-photos',
-        Key={
-            'PK': {'S': f"{store_id}#PHOTO"},
-            'SK': {'S': original_sk}
-        }
-    )
-    print(f"DynamoDB delete response: {delete_response}")
-    log_with_context("DynamoDB delete response", {"response": delete_response})
+    if not uploaded_at:
+        log_with_context(f"No upload timestamp for {file_name}, cannot locate record", level="error")
+        return False
+
+    pk = partition_key or photo_partition_key(store_id)
+    original_sk = photo_sort_key('PENDING', uploaded_at, file_name)
+    new_sk = photo_sort_key(status, uploaded_at, file_name)
 
-    # Prepare the new item with the updated SK
     new_item = {
-        'PK': {'S': f"{store_id}#PHOTO"},
+        'PK': {'S': pk},
         'SK': {'S': new_sk},
         'fileName': {'S': file_name},
         'status': {'S': status},
@@ -191,24 +391,476 @@ def update_dynamodb_record(store_id, file_name, status, result=None, error=None)
     if error:
         new_item['error'] = {'S': str(error)}
 
-    # Put the new item
-    put_response = retry_with_backoff(
-        aws_clients["dynamodb"].put_item,
-        TableName='localseo-photos',
-        Item=new_item
-    )
-    print(f"DynamoDB put response: {put_response}")
-    log_with_context("DynamoDB put response", {"response": put_response})
+    if content_hash:
+        # Thumbnails are keyed by content hash, so the dashboard needs it on the final record too
+        new_item['contentHash'] = {'S': content_hash}
+
+    if file_key:
+        # Lets reprocess_errors match a FAILED record to its object in the errors folder
+        new_item['fileKey'] = {'S': file_key}
+
+    if status == 'COMPLETED' and COMPLETED_RECORD_TTL:
+        new_item['expiresAt'] = {'N': str(int(time.time() + COMPLETED_RECORD_TTL))}
+
+    # Delete and put atomically so the record never disappears between the two writes
+    try:
+        with timer('DynamoDBWrite'):
+            retry_with_backoff(
+                get_client("dynamodb").transact_write_items,
+                TransactItems=[
+                    {
+                        'Delete': {
+                            'TableName': DYNAMODB_TABLE,
+                            'Key': {'PK': {'S': pk}, 'SK': {'S': original_sk}},
+                            'ConditionExpression': 'attribute_exists(PK)'
+                        }
+                    },
+                    {
+                        'Put': {
+                            'TableName': DYNAMODB_TABLE,
+                            'Item': new_item
+                        }
+                    }
+                ] + list(extra_items or [])
+            )
+    except ClientError as e:
+        if not _is_conditional_failure(e):
+            raise
+        log_with_context(f"No existing record found for {file_name}", {"sk": original_sk})
+        return False
 
-    log_with_context(f"DynamoDB record updated for {file_name}", {
+    log_with_context(f"DynamoDB record updated for {file_name}", level="debug", sample=True, context={
         "store_id": store_id,
         "file_name": file_name,
         "status": status,
         "new_sk": new_sk
     })
+    return True
+
+class IdempotencyStore:
+    """Track which stages of a photo upload have completed, keyed by fileKey.
+
+    The GBP call is the only stage that is neither cheap nor safe to repeat, so each
+    target store's result is written to DynamoDB as soon as it succeeds (one
+    "gbp#{storeId}" attribute per target, so a fan-out retry only repeats the
+    locations that failed). Completion of the whole
+    record rides along in the status transaction (completion_item). The S3 copy
+    and the status transition are idempotent and the upload source is only deleted
+    once a record completes, so they are simply redone on a retry. A small LRU
+    keeps recent states for the warm container; DynamoDB is only read for
+    redelivered messages.
+    """
+
+    def __init__(self, max_entries=IDEMPOTENCY_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(file_key):
+        return {'PK': {'S': f"{file_key}#IDEMPOTENCY"}, 'SK': {'S': 'STAGES'}}
+
+    def _remember(self, file_key, **stages):
+        with self._lock:
+            state = self._cache.pop(file_key, {})
+            gbp = {**state.get('gbp', {}), **stages.pop('gbp', {})}
+            state.update(stages, gbp=gbp)
+            self._cache[file_key] = state
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def load(self, file_key, check_store):
+        """Return completed stages: {'gbp': {storeId: result}, 'completed': bool}"""
+        with self._lock:
+            state = self._cache.get(file_key)
+            if state is not None:
+                self._cache.move_to_end(file_key)
+                return {**state, 'gbp': dict(state['gbp'])}
+        if not check_store:
+            return {}
+
+        with timer('IdempotencyRead'):
+            response = retry_with_backoff(
+                get_client("dynamodb").get_item,
+                TableName=DYNAMODB_TABLE,
+                Key=self._key(file_key),
+                ConsistentRead=True
+            )
+        item = response.get('Item')
+        if not item:
+            return {}
+        state = {
+            'completed': 'completedAt' in item,
+            'gbp': {
+                name.split('#', 1)[1]: json.loads(value['S'])
+                for name, value in item.items() if name.startswith('gbp#')
+            }
+        }
+        self._remember(file_key, **state)
+        return state
+
+    def mark_gbp_uploaded(self, file_key, message_id, store_id, result):
+        """Durably record a target's GBP result before any later stage can fail"""
+        self._remember(file_key, gbp={store_id: result})
+        try:
+            with timer('IdempotencyWrite'):
+                retry_with_backoff(
+                    get_client("dynamodb").update_item,
+                    TableName=DYNAMODB_TABLE,
+                    Key=self._key(file_key),
+                    UpdateExpression='SET #gbp = :result, gbpUpdatedAt = :now, messageId = :mid, expiresAt = :ttl',
+                    ConditionExpression='attribute_not_exists(#gbp)',
+                    ExpressionAttributeNames={'#gbp': f"gbp#{store_id}"},
+                    ExpressionAttributeValues=self._values(message_id, {':result': {'S': json.dumps(result)}})
+                )
+        except ClientError as e:
+            if not _is_conditional_failure(e):
+                raise
+            # A concurrent duplicate already recorded its upload; keep the first result
+
+    def completion_item(self, file_key, message_id):
+        """TransactWriteItems entry that marks the whole record as completed"""
+        return {
+            'Update': {
+                'TableName': DYNAMODB_TABLE,
+                'Key': self._key(file_key),
+                'UpdateExpression': 'SET completedAt = :now, messageId = :mid, expiresAt = :ttl',
+                'ExpressionAttributeValues': self._values(message_id)
+            }
+        }
+
+    def mark_completed(self, file_key, message_id, written=True):
+        """Remember completion; write it separately when the status transaction did not carry it"""
+        self._remember(file_key, completed=True)
+        if written:
+            return
+        update = self.completion_item(file_key, message_id)['Update']
+        retry_with_backoff(get_client("dynamodb").update_item, **update)
+
+    @staticmethod
+    def _values(message_id, extra=None):
+        now = time.time()
+        return {
+            ':now': {'S': datetime.now().isoformat()},
+            ':mid': {'S': message_id or ''},
+            ':ttl': {'N': str(int(now + IDEMPOTENCY_TTL))},
+            **(extra or {})
+        }
+
+idempotency_store = IdempotencyStore()
+
+class TokenBucket:
+    """Thread-safe token bucket whose refill rate adapts to GBP throttling"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Block until a token is available and any Retry-After pause has passed"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.blocked_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.blocked_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def block_for(self, seconds):
+        """Hold every caller sharing this bucket for at least the given time"""
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    def decrease(self):
+        """Halve the rate and drop banked tokens after a 429"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rate = max(GBP_MIN_RATE, self.rate * GBP_RATE_DECREASE)
+            self.tokens = 0
+
+    def increase(self):
+        """Recover rate additively after a success"""
+        with self._lock:
+            self.rate = min(GBP_RATE_LIMIT, self.rate + GBP_RATE_INCREASE)
+
+def get_gbp_limiter(account_id, location_id):
+    """Return the shared token bucket for an account/location"""
+    key = f"{account_id}/{location_id}"
+    with _gbp_limiters_lock:
+        limiter = _gbp_limiters.get(key)
+        if limiter is None:
+            limiter = _gbp_limiters[key] = TokenBucket(GBP_RATE_LIMIT, GBP_RATE_BURST)
+        return limiter
+
+class CircuitBreaker:
+    """Stop calling GBP during an outage, with the state shared by every container through DynamoDB"""
+
+    def __init__(self, key=CIRCUIT_KEY):
+        self.key = key
+        self._state = {'state': 'closed', 'failures': 0, 'openCount': 0, 'openUntil': 0.0}
+        self._loaded_at = float('-inf')
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _parse(item):
+        return {
+            'state': item.get('state', {}).get('S', 'closed'),
+            'failures': int(item.get('failures', {}).get('N', '0')),
+            'openCount': int(item.get('openCount', {}).get('N', '0')),
+            'openUntil': float(item.get('openUntil', {}).get('N', '0'))
+        }
+
+    def _remember(self, item):
+        with self._lock:
+            self._state = self._parse(item)
+            self._loaded_at = time.monotonic()
+
+    def state(self):
+        """The shared state, read from DynamoDB at most every CIRCUIT_REFRESH seconds"""
+        with self._lock:
+            if time.monotonic() - self._loaded_at < CIRCUIT_REFRESH:
+                return dict(self._state)
+            # Held during the read so no worker acts on a stale state (or the default one when cold)
+            try:
+                response = get_client("dynamodb").get_item(TableName=DYNAMODB_TABLE, Key=self.key)
+                self._state = self._parse(response.get('Item', {}))
+            except (BotoCoreError, ClientError) as e:
+                # Never blocks uploads: a breaker that cannot be read acts on its last known state
+                log_with_context("Circuit state read failed, using cached state", level="warning", error=e)
+            self._loaded_at = time.monotonic()
+            return dict(self._state)
+
+    def is_open(self):
+        """Whether calls are currently refused (open and not yet due for a probe)"""
+        state = self.state()
+        return state['state'] == 'open' and time.time() < state['openUntil']
+
+    def before_call(self):
+        """Return whether this call is a probe; raise CircuitOpenError when it must not be made"""
+        state = self.state()
+        if state['state'] != 'open':
+            return False
+        now = time.time()
+        if now < state['openUntil']:
+            raise CircuitOpenError(state['openUntil'] - now)
+        try:
+            get_client("dynamodb").update_item(
+                TableName=DYNAMODB_TABLE,
+                Key=self.key,
+                UpdateExpression='SET probeAt = :now',
+                ConditionExpression='#state = :open AND (attribute_not_exists(probeAt) OR probeAt < :stale)',
+                ExpressionAttributeNames={'#state': 'state'},
+                ExpressionAttributeValues={
+                    ':now': {'N': str(now)},
+                    ':stale': {'N': str(now - CIRCUIT_PROBE_INTERVAL)},
+                    ':open': {'S': 'open'}
+                }
+            )
+        except (BotoCoreError, ClientError) as e:
+            if _is_conditional_failure(e):
+                # Another container is probing, or the breaker has closed meanwhile
+                raise CircuitOpenError(CIRCUIT_PROBE_INTERVAL)
+            log_with_context("Circuit probe claim failed, calling GBP", level="warning", error=e)
+            return False
+        count('CircuitProbes')
+        return True
+
+    def record_success(self, probe):
+        """Close the breaker after a probe, or reset the failure run"""
+        state = self.state()
+        if not probe and state['failures'] == 0:
+            return
+        if probe:
+            update = {
+                'UpdateExpression': 'SET #state = :closed, failures = :zero, openCount = :zero '
+                                    'REMOVE openUntil, probeAt',
+                'ExpressionAttributeValues': {':closed': {'S': 'closed'}, ':zero': {'N': '0'}}
+            }
+        else:
+            # A call started before the breaker opened must not close it
+            update = {
+                'UpdateExpression': 'SET failures = :zero',
+                'ConditionExpression': 'attribute_not_exists(#state) OR #state = :closed',
+                'ExpressionAttributeValues': {':closed': {'S': 'closed'}, ':zero': {'N': '0'}}
+            }
+        try:
+            response = get_client("dynamodb").update_item(
+                TableName=DYNAMODB_TABLE,
+                Key=self.key,
+                ExpressionAttributeNames={'#state': 'state'},
+                ReturnValues='ALL_NEW',
+                **update
+            )
+            self._remember(response['Attributes'])
+        except (BotoCoreError, ClientError) as e:
+            if not _is_conditional_failure(e):
+                log_with_context("Circuit state update failed", level="warning", error=e)
+            return
+        if probe:
+            log_with_context("GBP circuit breaker closed", {"state": "closed"})
+
+    def record_failure(self, probe):
+        """Count an outage failure, opening (or reopening after a probe) the breaker"""
+        client = get_client("dynamodb")
+        try:
+            response = client.update_item(
+                TableName=DYNAMODB_TABLE,
+                Key=self.key,
+                UpdateExpression='ADD failures :one',
+                ExpressionAttributeValues={':one': {'N': '1'}},
+                ReturnValues='ALL_NEW'
+            )
+            state = self._parse(response['Attributes'])
+            if not probe and (state['state'] == 'open' or state['failures'] < CIRCUIT_FAILURE_THRESHOLD):
+                self._remember(response['Attributes'])
+                return
+
+            open_for = min(CIRCUIT_MAX_OPEN_SECONDS, CIRCUIT_OPEN_SECONDS * 2 ** state['openCount'])
+            values = {
+                ':open': {'S': 'open'},
+                ':until': {'N': str(time.time() + open_for)},
+                ':one': {'N': '1'}
+            }
+            # Only the container that tripped it (or the probe) sets the open period
+            if probe:
+                condition = '#state = :open'
+            else:
+                condition = 'attribute_not_exists(#state) OR #state = :closed'
+                values[':closed'] = {'S': 'closed'}
+            response = client.update_item(
+                TableName=DYNAMODB_TABLE,
+                Key=self.key,
+                UpdateExpression='SET #state = :open, openUntil = :until ADD openCount :one REMOVE probeAt',
+                ConditionExpression=condition,
+                ExpressionAttributeNames={'#state': 'state'},
+                ExpressionAttributeValues=values,
+                ReturnValues='ALL_NEW'
+            )
+            self._remember(response['Attributes'])
+        except (BotoCoreError, ClientError) as e:
+            if not _is_conditional_failure(e):
+                log_with_context("Circuit state update failed", level="warning", error=e)
+            return
+        count('CircuitOpened')
+        log_with_context("GBP circuit breaker opened", {
+            "open_seconds": open_for,
+            "failures": state['failures'],
+            "probe": probe
+        }, level="warning")
+
+gbp_circuit = CircuitBreaker()
+
+def defer_delay(receive_count, retry_after):
+    """Visibility delay for a deferred message: doubles per receive, never before retry_after"""
+    delay = DEFER_BASE_DELAY * 2 ** min(max(receive_count - 1, 0), 10)
+    # Jitter spreads the deferred backlog so it does not return all at once
+    delay = random.uniform(delay / 2, delay)
+    return int(min(DEFER_MAX_DELAY, max(delay, retry_after)))
 
-def upload_photo_to_gbp(file_key, file_name, store_id, content_type):
-    """Upload photo to Google Business Profile with enhanced error handling"""
+def defer_messages(deferred, request_id=None):
+    """Return messages to the queue after their delay with ChangeMessageVisibilityBatch.
+
+    Messages whose visibility cannot be changed still come back (after the queue's
+    visibility timeout), since they are reported as batch item failures.
+    """
+    failed = 0
+    for start in range(0, len(deferred), VISIBILITY_BATCH_SIZE):
+        chunk = deferred[start:start + VISIBILITY_BATCH_SIZE]
+        try:
+            response = get_client("sqs").change_message_visibility_batch(
+                QueueUrl=QUEUE_URL,
+                Entries=[{
+                    'Id': str(index),
+                    'ReceiptHandle': failure['receiptHandle'],
+                    'VisibilityTimeout': failure['deferSeconds']
+                } for index, failure in enumerate(chunk)]
+            )
+            failed += len(response.get('Failed', []))
+        except ClientError as e:
+            failed += len(chunk)
+            log_with_context("Deferring messages failed", level="warning", error=e, request_id=request_id)
+    count('DeferredMessages', len(deferred) - failed)
+    log_with_context("Messages deferred while GBP circuit is open", {
+        "deferred": len(deferred) - failed,
+        "failed": failed
+    }, request_id=request_id)
+
+def _retry_after_seconds(response):
+    """Parse a Retry-After header given in seconds or as an HTTP date"""
+    value = response.headers.get('Retry-After')
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+def post_with_rate_limit(session, url, payload, limiter, max_attempts=MAX_RETRIES):
+    """POST to GBP through the limiter, retrying only retryable statuses with jittered backoff.
+
+    Retries stop as soon as the circuit breaker opens, rather than sleeping through an outage.
+    """
+    attempt = 0
+    while True:
+        with timer('GbpRateLimitWait'):
+            limiter.acquire()
+        with timer('GbpCreateMedia'):
+            response = session.post(
+                url,
+                headers={'Content-Type': 'application/json'},
+                json=payload,
+                timeout=UPLOAD_TIMEOUT
+            )
+
+        if response.status_code not in RETRYABLE_STATUSES:
+            if response.ok:
+                limiter.increase()
+            return response
+
+        if response.status_code == 429:
+            count('GbpThrottled')
+            limiter.decrease()
+
+        attempt += 1
+        retry_after = _retry_after_seconds(response)
+        if attempt >= max_attempts or (retry_after is not None and retry_after > GBP_MAX_RETRY_AFTER):
+            return response
+        if gbp_circuit.is_open():
+            return response
+
+        # Full jitter keeps concurrent workers from retrying in lockstep
+        delay = retry_after if retry_after is not None else random.uniform(
+            0, min(GBP_MAX_BACKOFF, RETRY_DELAY * 2 ** attempt)
+        )
+        log_with_context("Retrying GBP request", {
+            "status_code": response.status_code,
+            "attempt": attempt,
+            "delay": round(delay, 3),
+            "rate": round(limiter.rate, 3)
+        }, level="warning")
+        count('Retries')
+        if retry_after is not None:
+            limiter.block_for(delay)
+            continue
+        time.sleep(delay)
+
+def upload_photo_to_gbp(file_key, file_name, store_id, content_type, message_id=None):
+    """Upload photo to Google Business Profile, recording the result in the idempotency store"""
     try:
         log_context = {
             "file_key": file_key,
@@ -216,20 +868,16 @@ def upload_photo_to_gbp(file_key, file_name, store_id, content_type):
             "store_id": store_id,
             "content_type": content_type
         }
-        log_with_context("Starting photo upload to GBP", log_context)
+        log_with_context("Starting photo upload to GBP", log_context, level="debug", sample=True)
         
-        session = get_authenticated_session()
-        location_id = LOCATION_CONFIG.get(store_id)
-        
-        if not location_id:
-            raise ValueError(f"Invalid store ID: {store_id}")
+        account_id, location_id = get_location(store_id)
         
         # Generate the public URL for the S3 object
         public_url = f"https://{BUCKET_NAME}.s3.amazonaws.com/{file_key}"
-        log_with_context("Generated public URL", {"url": public_url})
+        log_with_context("Generated public URL", {"url": public_url}, level="debug", sample=True)
 
         # Create media item using the public URL
-        create_url = f"{GBP_API_BASE}/accounts/106507314990610040138/locations/{location_id}/media"
+        create_url = f"{GBP_API_BASE}/accounts/{account_id}/locations/{location_id}/media"
         
         create_payload = {
             "mediaFormat": "PHOTO",
@@ -240,25 +888,48 @@ def upload_photo_to_gbp(file_key, file_name, store_id, content_type):
             "description": f"Store photo - {file_name}"
         }
         
-        create_response = session.post(
-            create_url,
-            headers={'Content-Type': 'application/json'},
-            json=create_payload
-        )
+        # Raises CircuitOpenError while GBP is down, before authenticating
+        probe = gbp_circuit.before_call()
+        try:
+            session = get_authenticated_session()
+            create_response = post_with_rate_limit(
+                session,
+                create_url,
+                create_payload,
+                get_gbp_limiter(account_id, location_id),
+                # A probe only tests whether GBP is back
+                max_attempts=1 if probe else MAX_RETRIES
+            )
+        except Exception:
+            # Token endpoint failures, connection errors and timeouts
+            gbp_circuit.record_failure(probe)
+            raise
+        # Other 4xx responses are about this photo, not an outage
+        if create_response.status_code in RETRYABLE_STATUSES:
+            gbp_circuit.record_failure(probe)
+        elif not create_response.ok:
+            gbp_circuit.record_success(probe)
         
-        log_with_context("Received media creation response", {
+        # Response bodies are only logged in full (truncated) when the call failed
+        log_with_context("Received media creation response", lambda: {
             "status_code": create_response.status_code,
             "response_text": create_response.text
-        })
+        }, level="debug" if create_response.ok else "warning", sample=create_response.ok)
         
         create_response.raise_for_status()
         
-        return {
+        result = {
             'success': True,
             'file_name': file_name,
             'response': create_response.json()
         }
+        # The photo is on GBP: make that durable before the breaker bookkeeping
+        idempotency_store.mark_gbp_uploaded(file_key, message_id, store_id, result)
+        gbp_circuit.record_success(probe)
+        return result
 
+    except CircuitOpenError:
+        raise
     except Exception as e:
         log_with_context(
             "Photo upload failed",
@@ -268,10 +939,75 @@ def upload_photo_to_gbp(file_key, file_name, store_id, content_type):
         )
         raise
 
-def process_message(message, request_id):
+def _get_fanout_pool():
+    global _fanout_pool
+    if _fanout_pool is None:
+        with _fanout_pool_lock:
+            if _fanout_pool is None:
+                _fanout_pool = ThreadPoolExecutor(max_workers=FANOUT_CONCURRENCY, thread_name_prefix="gbp-fanout")
+    return _fanout_pool
+
+def upload_to_targets(body, message_id, done):
+    """Post the photo to every target store not already in done; return {storeId: result}.
+
+    A message targets body['storeIds'] when present (fan-out), otherwise body['storeId'].
+    Each success is recorded in the idempotency store as it lands, so when some
+    targets fail the redelivered message only retries those.
+    """
+    targets = list(dict.fromkeys(body.get('storeIds') or [body['storeId']]))
+    results = {store_id: done[store_id] for store_id in targets if store_id in done}
+    pending = [store_id for store_id in targets if store_id not in done]
+    if results:
+        count('IdempotentSkips', len(results))
+
+    def upload(store_id):
+        return upload_photo_to_gbp(body['fileKey'], body['fileName'], store_id, body['contentType'], message_id)
+
+    if len(pending) == 1:
+        results[pending[0]] = upload(pending[0])
+        return results
+
+    recorder = current_metrics()
+
+    def upload_bound(store_id):
+        with bind(recorder):
+            return upload(store_id)
+
+    futures = {store_id: _get_fanout_pool().submit(upload_bound, store_id) for store_id in pending}
+    errors = {}
+    for store_id, future in futures.items():
+        try:
+            results[store_id] = future.result()
+        except Exception as e:
+            errors[store_id] = e
+    if errors:
+        count('FanoutFailures', len(errors))
+        deferred = [e for e in errors.values() if isinstance(e, CircuitOpenError)]
+        if deferred:
+            # Defer the whole message; the locations that succeeded are skipped on redelivery
+            raise deferred[0]
+        raise RuntimeError(
+            f"GBP upload failed for {len(errors)} of {len(targets)} locations: "
+            + ", ".join(f"{store_id}: {e}" for store_id, e in errors.items())
+        )
+    return results
+
+def combine_target_results(body, results):
+    """Shape per-target results as the record's result: unchanged for single-store messages"""
+    if not body.get('storeIds'):
+        return results.get(body['storeId'])
+    return {
+        'success': all(result.get('success') for result in results.values()),
+        'file_name': body['fileName'],
+        'targets': results
+    }
+
+def process_message(message, request_id, move_stage):
     """Process SQS message with enhanced error handling and update DynamoDB"""
     message_id = message.get('messageId')
-    log_with_context("Processing message", {"message_id": message_id}, request_id=request_id)
+    log_with_context("Processing message", {"message_id": message_id}, level="debug", request_id=request_id)
+    gbp_uploaded = False
+    body = None
     
     try:
         # Parse and validate message body
@@ -281,77 +1017,110 @@ def process_message(message, request_id):
         missing_fields = [field for field in required_fields if field not in body]
         if missing_fields:
             raise ValueError(f"Missing required fields: {', '.join(missing_fields)}")
+        set_dimension('storeId', body['storeId'])
 
-        # Upload photo and process result
-        result = upload_photo_to_gbp(
-            body['fileKey'],
-            body['fileName'],
-            body['storeId'],
-            body['contentType']
-        )
+        # Only redeliveries (and reprocessed photos, which carry no attributes) can have stored progress,
+        # so first deliveries skip the read
+        attributes = message.get('attributes')
+        check_store = attributes is None or int(attributes.get('ApproximateReceiveCount', '1')) > 1
+        stages = idempotency_store.load(body['fileKey'], check_store=check_store)
+        if stages.get('completed'):
+            count('IdempotentSkips')
+            log_with_context("Message already processed, skipping", {
+                "message_id": message_id,
+                "file_key": body['fileKey']
+            }, request_id=request_id)
+            # The attempt that completed it may have stopped before its delete was flushed;
+            # deleting a key that is already gone is a no-op
+            move_stage.delete_later(body['fileKey'], message_id)
+            return combine_target_results(body, stages.get('gbp', {}))
 
-        # Debug print statement for result
-        print(f"Upload result: {result}")
-        log_with_context("Upload result", {"result": result}, request_id=request_id)
-
-        # Move file to processed folder after successful upload
-        new_key = body['fileKey'].replace("local-seo-photos/uploads", PROCESSED_FOLDER)
-        retry_with_backoff(
-            aws_clients["s3"].copy_object,
-            Bucket=BUCKET_NAME,
-            CopySource={'Bucket': BUCKET_NAME, 'Key': body['fileKey']},
-            Key=new_key
-        )
-        retry_with_backoff(
-            aws_clients["s3"].delete_object,
-            Bucket=BUCKET_NAME,
-            Key=body['fileKey']
-        )
+        # Targets a previous attempt already uploaded to are skipped
+        result = combine_target_results(body, upload_to_targets(body, message_id, stages.get('gbp', {})))
+        gbp_uploaded = True
+
+        log_with_context("Upload result", {"result": result}, level="debug", request_id=request_id, sample=True)
+
+        # Copy to the processed folder; the source is only deleted once the record completes
+        new_key = body['fileKey'].replace(UPLOADS_FOLDER, PROCESSED_FOLDER)
+        move_stage.copy(body['fileKey'], new_key)
         # Log successful S3 photo movement
-        log_with_context("File moved to processed folder", {"new_key": new_key}, request_id=request_id)
-
-        # Update DynamoDB record with success status
-        update_dynamodb_record(body['storeId'], body['fileName'], 'COMPLETED', result=result)
-        # Debug print statement for DynamoDB update
-        print(f"DynamoDB update result: {result}")
-        log_with_context("DynamoDB update result", {"result": result}, request_id=request_id)
-
-        # Delete message after successful processing
-        receipt_handle = message.get('receiptHandle')
-        if not receipt_handle:
-            raise KeyError('receiptHandle')
-        
-        aws_clients["sqs"].delete_message(
-            QueueUrl=QUEUE_URL,
-            ReceiptHandle=receipt_handle
+        log_with_context(
+            "File copied to processed folder", {"new_key": new_key},
+            level="debug", request_id=request_id, sample=True
         )
-        # Log successful SQS message deletion
-        log_with_context("SQS message deleted", {"receipt_handle": receipt_handle}, request_id=request_id)
-        
+
+        # Update DynamoDB record with success status and mark the upload completed in the same transaction
+        completion_items = [idempotency_store.completion_item(body['fileKey'], message_id)]
+        if body.get('contentHash'):
+            # Duplicate uploads are answered with the index entry's key, and the upload source is about to go
+            completion_items.append({'Update': {
+                'TableName': DYNAMODB_TABLE,
+                'Key': content_index_key(body['contentHash'], body['storeId']),
+                'UpdateExpression': 'SET fileKey = :key',
+                'ExpressionAttributeValues': {':key': {'S': new_key}}
+            }})
+        written = update_dynamodb_record(
+            body['storeId'], body['fileName'], body.get('uploadedAt'), 'COMPLETED', result=result,
+            extra_items=completion_items,
+            content_hash=body.get('contentHash'), file_key=body['fileKey'],
+            partition_key=body.get('partitionKey')
+        )
+        idempotency_store.mark_completed(body['fileKey'], message_id, written=written)
+        move_stage.delete_later(body['fileKey'], message_id)
+
+        # No delete_message here: the handler reports only failed records via
+        # batchItemFailures and SQS acknowledges the rest of the batch itself
         log_with_context("Message processed successfully", {
             "message_id": message_id,
-            "result": result
+            "file_name": body['fileName']
         }, request_id=request_id)
         
         return result
 
+    except CircuitOpenError:
+        # Nothing failed: leave the record PENDING and the file in place for the redelivery
+        raise
     except Exception as e:
-        # Update DynamoDB record with error status
-        update_dynamodb_record(body['storeId'], body['fileName'], 'FAILED', error=e)
+        if not isinstance(body, dict) or any(field not in body for field in ('fileKey', 'fileName', 'storeId')):
+            # No record or photo to fail, and a redelivery would be just as malformed
+            log_with_context("Malformed message", {"message_id": message_id}, level="error", error=e,
+                             request_id=request_id)
+            raise PhotoFailedError(e) from e
+        if not gbp_uploaded:
+            # A fan-out that reached some locations is resumed like a completed GBP stage
+            gbp_uploaded = bool(idempotency_store.load(body['fileKey'], check_store=False).get('gbp'))
+        if gbp_uploaded:
+            # The photo is already on GBP; leave the record PENDING and the file in place
+            # so the redelivered message resumes from the stage that failed
+            log_with_context(
+                "Message processing failed after GBP upload, will resume on retry",
+                context={"message_id": message_id},
+                level="error",
+                error=e,
+                request_id=request_id
+            )
+            raise
 
-        # Move file to errors folder
-        error_key = body['fileKey'].replace("local-seo-photos/uploads", ERRORS_FOLDER)
-        retry_with_backoff(
-            aws_clients["s3"].copy_object,
-            Bucket=BUCKET_NAME,
-            CopySource={'Bucket': BUCKET_NAME, 'Key': body['fileKey']},
-            Key=error_key
-        )
-        retry_with_backoff(
-            aws_clients["s3"].delete_object,
-            Bucket=BUCKET_NAME,
-            Key=body['fileKey']
+        # Update DynamoDB record with error status and release the content index entry,
+        # so uploading the same photo again is not rejected as a duplicate
+        release_items = []
+        if body.get('contentHash'):
+            release_items.append({'Delete': {
+                'TableName': DYNAMODB_TABLE,
+                'Key': content_index_key(body['contentHash'], body['storeId'])
+            }})
+        written = update_dynamodb_record(
+            body['storeId'], body['fileName'], body.get('uploadedAt'), 'FAILED', error=e,
+            extra_items=release_items, content_hash=body.get('contentHash'), file_key=body['fileKey'],
+            partition_key=body.get('partitionKey')
         )
+        if release_items and not written:
+            retry_with_backoff(get_client("dynamodb").delete_item, **release_items[0]['Delete'])
+
+        # Move file to errors folder
+        error_key = body['fileKey'].replace(UPLOADS_FOLDER, ERRORS_FOLDER)
+        move_stage.move(body['fileKey'], error_key)
         # Log file movement to errors folder
         log_with_context("File moved to errors folder", {"error_key": error_key}, request_id=request_id)
 
@@ -362,53 +1131,384 @@ def process_message(message, request_id):
             error=e,
             request_id=request_id
         )
+        # The record is FAILED and the photo in the errors folder; a redelivery would post a deleted object
+        raise PhotoFailedError(e) from e
+
+def _process_record(record, request_id, move_stage):
+    """Process one record, returning (result, failure) instead of raising"""
+    with MetricsRecorder(METRICS_SERVICE, {"storeId": "unknown", "outcome": "success"}) as metrics:
+        try:
+            with metrics.timer('Record'):
+                return process_message(record, request_id, move_stage), None
+        except CircuitOpenError as e:
+            metrics.set_dimension('outcome', 'deferred')
+            receive_count = int(record.get('attributes', {}).get('ApproximateReceiveCount', '1'))
+            return None, {
+                'messageId': record.get('messageId'),
+                'receiptHandle': record.get('receiptHandle'),
+                'deferSeconds': defer_delay(receive_count, e.retry_after),
+                'error': str(e),
+                'errorType': e.__class__.__name__
+            }
+        except PhotoFailedError as e:
+            metrics.set_dimension('outcome', 'failure')
+            return None, {
+                'messageId': record.get('messageId'),
+                'error': str(e),
+                'errorType': e.error.__class__.__name__,
+                'acknowledged': True
+            }
+        except Exception as e:
+            # The record is still PENDING with its file in place, so the redelivery resumes it
+            metrics.set_dimension('outcome', 'failure')
+            return None, {
+                'messageId': record.get('messageId'),
+                'error': str(e),
+                'errorType': e.__class__.__name__
+            }
+
+def process_records(records, request_id, max_concurrency=None):
+    """Process a batch of records on a bounded worker pool, preserving record order"""
+    max_concurrency = max_concurrency or MAX_CONCURRENCY
+    move_stage = S3MoveStage()
+    
+    if max_concurrency <= 1 or len(records) <= 1:
+        outcomes = [_process_record(record, request_id, move_stage) for record in records]
+    else:
+        with ThreadPoolExecutor(max_workers=min(max_concurrency, len(records))) as executor:
+            outcomes = list(executor.map(
+                lambda record: _process_record(record, request_id, move_stage), records
+            ))
+
+    delete_results = move_stage.flush()
+    log_with_context("S3 source deletes flushed", {
+        "deleted": sum(1 for outcome in delete_results.values() if outcome == 'Deleted'),
+        "failed": sum(1 for outcome in delete_results.values() if outcome != 'Deleted')
+    }, request_id=request_id)
+
+    # A completed record whose upload source is still there goes back to the queue,
+    # so the delete is retried by its redelivery instead of being lost
+    undeleted = move_stage.failed_owners()
+    if undeleted:
+        outcomes = [
+            (None, {
+                'messageId': record.get('messageId'),
+                'error': "S3 source delete failed",
+                'errorType': 'S3DeleteError'
+            }) if failure is None and record.get('messageId') in undeleted else (result, failure)
+            for record, (result, failure) in zip(records, outcomes)
+        ]
+
+    results = [result for result, failure in outcomes if failure is None]
+    failed_messages = [failure for result, failure in outcomes if failure is not None]
+    deferred = [failure for failure in failed_messages if failure.get('receiptHandle')]
+    if deferred:
+        defer_messages(deferred, request_id)
+    return results, failed_messages
+
+def build_batch_response(failed_messages):
+    """Build the SQS partial batch response (requires ReportBatchItemFailures on the event source mapping)"""
+    return {
+        'batchItemFailures': [
+            {'itemIdentifier': failure['messageId']} for failure in failed_messages
+            if not failure.get('acknowledged')
+        ]
+    }
+
+def error_object_source(error_key):
+    """(store_id, file_name, upload_key) for an errors-folder object, or None for keys it cannot map"""
+    # Presigned uploads live one level deeper, mirroring DIRECT_UPLOADS_FOLDER
+    parsed = parse_file_key(error_key, f"{ERRORS_FOLDER}/direct") or parse_file_key(error_key, ERRORS_FOLDER)
+    if parsed is None:
+        return None
+    return (*parsed, error_key.replace(ERRORS_FOLDER, UPLOADS_FOLDER, 1))
+
+def reprocess_stage_key(upload_key):
+    """Where a photo is copied back for reprocessing: its upload key, minus the direct-upload prefix"""
+    # Under DIRECT_UPLOADS_FOLDER the save Lambda's ObjectCreated notification would finalize it again
+    if upload_key.startswith(f"{DIRECT_UPLOADS_FOLDER}/"):
+        return f"{UPLOADS_FOLDER}/{upload_key[len(DIRECT_UPLOADS_FOLDER) + 1:]}"
+    return upload_key
+
+def list_error_objects(prefixes, start_after=None):
+    """Yield the errors-folder objects under the prefixes in key order, after start_after"""
+    # Prefixes that do not nest cover disjoint key ranges, so listing them sorted keeps the order
+    for prefix in sorted(prefixes):
+        kwargs = {'Bucket': BUCKET_NAME, 'Prefix': prefix}
+        if start_after:
+            kwargs['StartAfter'] = start_after
+        for page in get_client("s3").get_paginator('list_objects_v2').paginate(**kwargs):
+            yield from page.get('Contents', [])
+
+def load_failed_records(store_id):
+    """Index a store's FAILED records by fileKey, and by fileName for records written before fileKey was stored"""
+    # Sort keys embed the upload time, which the object key does not carry, so query every shard
+    records = {'by_key': {}, 'by_name': {}}
+    for partition_key in photo_partition_keys(store_id):
+        kwargs = {
+            'TableName': DYNAMODB_TABLE,
+            'KeyConditionExpression': 'PK = :pk AND begins_with(SK, :failed)',
+            'ExpressionAttributeValues': {
+                ':pk': {'S': partition_key},
+                ':failed': {'S': 'FAILED#'}
+            }
+        }
+        while True:
+            response = retry_with_backoff(get_client("dynamodb").query, **kwargs)
+            for item in response.get('Items', []):
+                if 'fileKey' in item:
+                    records['by_key'][item['fileKey']['S']] = item
+                else:
+                    records['by_name'].setdefault(item['fileName']['S'], []).append(item)
+            if 'LastEvaluatedKey' not in response:
+                break
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    return records
+
+def match_failed_record(records, file_name, upload_key):
+    record = records['by_key'].get(upload_key)
+    if record is None and records['by_name'].get(file_name):
+        record = records['by_name'][file_name][0]
+    return record
+
+def restore_failed_record(store_id, record, upload_key):
+    """Restore a FAILED record to PENDING and reclaim its content index entry; None if either has moved on"""
+    _, uploaded_at, file_name = record['SK']['S'].split('#', 2)
+    pending = {
+        'PK': record['PK'],
+        'SK': {'S': photo_sort_key('PENDING', uploaded_at, file_name)},
+        'fileName': {'S': file_name},
+        'fileKey': {'S': upload_key},
+        'uploadTimestamp': {'S': uploaded_at},
+        'status': {'S': 'PENDING'}
+    }
+    items = [
+        {'Delete': {
+            'TableName': DYNAMODB_TABLE,
+            'Key': {'PK': record['PK'], 'SK': record['SK']},
+            'ConditionExpression': 'attribute_exists(PK)'
+        }},
+        {'Put': {'TableName': DYNAMODB_TABLE, 'Item': pending}}
+    ]
+    if 'contentHash' in record:
+        pending['contentHash'] = record['contentHash']
+        items.append({'Put': {
+            'TableName': DYNAMODB_TABLE,
+            'Item': {
+                **content_index_key(record['contentHash']['S'], store_id),
+                'fileKey': {'S': upload_key},
+                'fileName': {'S': file_name},
+                'indexedAt': {'S': datetime.now().isoformat()}
+            },
+            'ConditionExpression': 'attribute_not_exists(PK)'
+        }})
+    try:
+        retry_with_backoff(get_client("dynamodb").transact_write_items, TransactItems=items)
+    except ClientError as e:
+        if not _is_conditional_failure(e):
+            raise
+        return None
+    return uploaded_at
+
+def reprocess_error_object(obj, records, dry_run, move_stage, request_id=None):
+    """Re-drive one errors-folder photo through process_message; returns its outcome"""
+    error_key = obj['Key']
+    source = error_object_source(error_key)
+    if source is None:
+        return 'skipped'
+    store_id, file_name, upload_key = source
+    record = match_failed_record(records[store_id], file_name, upload_key)
+    if record is None:
+        return 'no_record'
+    if dry_run:
+        return 'would_reprocess'
+    if gbp_circuit.is_open():
+        raise CircuitOpenError(CIRCUIT_PROBE_INTERVAL)
+
+    # GBP fetches the photo from the uploads folder, and success or failure then follows the message path
+    stage_key = reprocess_stage_key(upload_key)
+    move_stage.copy(error_key, stage_key)
+    uploaded_at = restore_failed_record(store_id, record, stage_key)
+    if uploaded_at is None:
+        retry_with_backoff(get_client("s3").delete_object, Bucket=BUCKET_NAME, Key=stage_key)
+        return 'superseded'
+
+    content_hash = record.get('contentHash', {}).get('S')
+    body = {
+        'fileKey': stage_key,
+        'fileName': file_name,
+        'storeId': store_id,
+        'contentType': mimetypes.guess_type(file_name)[0] or 'image/jpeg',
+        'uploadedAt': uploaded_at,
+        'fileSize': obj.get('Size'),
+        'partitionKey': record['PK']['S']
+    }
+    if content_hash:
+        body['contentHash'] = content_hash
+    # No SQS attributes: process_message then reads any progress an earlier run left for stage_key
+    message = {'messageId': f"reprocess:{error_key}", 'body': body}
+    try:
+        process_message(message, request_id, move_stage)
+    except PhotoFailedError:
+        # process_message has marked it FAILED and moved it back to the errors folder,
+        # under a new key when it was re-staged outside the direct-upload prefix
+        if stage_key.replace(UPLOADS_FOLDER, ERRORS_FOLDER, 1) != error_key:
+            move_stage.delete_later(error_key)
+        return 'failed'
+    except Exception as e:
+        # Left PENDING for a redelivery, but no message is queued behind a reprocess: put the photo back
+        release_items = []
+        if content_hash:
+            release_items.append({'Delete': {
+                'TableName': DYNAMODB_TABLE,
+                'Key': content_index_key(content_hash, store_id)
+            }})
+        # The photo is still at error_key, so the record keeps the key that maps back to it
+        update_dynamodb_record(
+            store_id, file_name, uploaded_at, 'FAILED', error=e, extra_items=release_items,
+            content_hash=content_hash, file_key=upload_key, partition_key=record['PK']['S']
+        )
+        retry_with_backoff(get_client("s3").delete_object, Bucket=BUCKET_NAME, Key=stage_key)
         raise
+    move_stage.delete_later(error_key)
+    return 'reprocessed'
+
+def _reprocess_bound(obj, records, dry_run, move_stage, request_id):
+    with MetricsRecorder(METRICS_SERVICE, {"storeId": "unknown", "outcome": "reprocess"}) as metrics:
+        try:
+            outcome = reprocess_error_object(obj, records, dry_run, move_stage, request_id)
+        except CircuitOpenError:
+            outcome = 'deferred'
+        except Exception as e:
+            log_with_context("Reprocessing failed", {"key": obj['Key']}, level="error", error=e,
+                             request_id=request_id)
+            outcome = 'error'
+        metrics.set_dimension('outcome', f"reprocess-{outcome}")
+        return outcome
+
+def reprocess_errors(store_id=None, dry_run=False, restart=False, limit=None, deadline=None, request_id=None):
+    """Re-drive the errors folder through the normal upload path, resuming from the last checkpoint"""
+    if store_id:
+        # Presigned uploads fail into a direct subfolder, mirroring DIRECT_UPLOADS_FOLDER
+        prefixes = [f"{ERRORS_FOLDER}/{store_id}/", f"{ERRORS_FOLDER}/direct/{store_id}/"]
+    else:
+        prefixes = [f"{ERRORS_FOLDER}/"]
+    checkpoint_key = {'PK': {'S': REPROCESS_CHECKPOINT_PK}, 'SK': {'S': store_id or "ALL"}}
+    dynamodb = get_client("dynamodb")
+
+    start_after = None
+    if not restart:
+        item = dynamodb.get_item(TableName=DYNAMODB_TABLE, Key=checkpoint_key, ConsistentRead=True).get('Item')
+        start_after = item['startAfter']['S'] if item else None
+
+    outcomes = {}
+    records = {}
+    checkpoint = start_after
+    examined = 0
+    complete = False
+    move_stage = S3MoveStage()
+    objects = list_error_objects(prefixes, start_after)
+
+    with ThreadPoolExecutor(max_workers=REPROCESS_CONCURRENCY) as pool:
+        try:
+            while True:
+                chunk_size = REPROCESS_CHUNK_SIZE if limit is None else min(REPROCESS_CHUNK_SIZE, limit - examined)
+                chunk = [obj for _, obj in zip(range(chunk_size), objects)]
+                if not chunk:
+                    complete = limit is None or examined < limit
+                    break
+                examined += len(chunk)
+
+                for obj in chunk:
+                    source = error_object_source(obj['Key'])
+                    if source and source[0] not in records:
+                        records[source[0]] = load_failed_records(source[0])
+                results = list(pool.map(
+                    lambda obj: _reprocess_bound(obj, records, dry_run, move_stage, request_id), chunk
+                ))
+                for outcome in results:
+                    outcomes[outcome] = outcomes.get(outcome, 0) + 1
+
+                # Resume at the first photo deferred by the circuit breaker, if any
+                done = results.index('deferred') if 'deferred' in results else len(chunk)
+                if done:
+                    checkpoint = chunk[done - 1]['Key']
+                if not dry_run and checkpoint:
+                    dynamodb.put_item(TableName=DYNAMODB_TABLE, Item={
+                        **checkpoint_key,
+                        'startAfter': {'S': checkpoint},
+                        'updatedAt': {'S': datetime.now().isoformat()}
+                    })
+                # deadline is a time.monotonic() value; the next invocation resumes at the checkpoint
+                if done < len(chunk) or (deadline is not None and time.monotonic() >= deadline):
+                    break
+        finally:
+            move_stage.flush()
+
+    if complete and not dry_run:
+        dynamodb.delete_item(TableName=DYNAMODB_TABLE, Key=checkpoint_key)
+    log_with_context("Errors folder reprocess run finished", {
+        "prefixes": prefixes,
+        "dry_run": dry_run,
+        "outcomes": outcomes,
+        "checkpoint": checkpoint,
+        "complete": complete
+    }, request_id=request_id)
+    return {
+        'outcomes': outcomes,
+        'examined': examined,
+        'checkpoint': checkpoint,
+        'complete': complete
+    }
 
 def lambda_handler(event, context):
-    """Main Lambda handler with comprehensive error handling"""
-    print(event)
-    
+    """Main Lambda handler; only messages that can still be resumed are returned to the queue.
+
+    Invoked directly with {"reprocess": {"storeId", "dryRun", "restart", "limit"}}
+    (all optional) it re-drives the errors folder instead; see reprocess_errors.
+    """
+    global _cold_start
     start_time = time.time()
     request_id = context.aws_request_id
-    
+
+    if 'reprocess' in event:
+        options = event['reprocess'] or {}
+        return reprocess_errors(
+            store_id=options.get('storeId'),
+            dry_run=bool(options.get('dryRun')),
+            restart=bool(options.get('restart')),
+            limit=options.get('limit'),
+            deadline=time.monotonic() + context.get_remaining_time_in_millis() / 1000 - REPROCESS_TIME_MARGIN,
+            request_id=request_id
+        )
+
     log_with_context("Lambda invocation started", {
         "record_count": len(event.get('Records', [])),
-        "request_id": request_id
+        "request_id": request_id,
+        "max_concurrency": MAX_CONCURRENCY
     }, request_id=request_id)
     
     try:
-        results = []
-        failed_messages = []
-        
-        for record in event.get('Records', []):
-            try:
-                result = process_message(record, request_id)
-                results.append(result)
-            except Exception as e:
-                failed_messages.append({
-                    'messageId': record.get('messageId'),
-                    'error': str(e),
-                    'errorType': e.__class__.__name__
-                })
+        with MetricsRecorder(METRICS_SERVICE, {"outcome": "batch"}) as batch_metrics:
+            with batch_metrics.timer('Batch'):
+                results, failed_messages = process_records(event.get('Records', []), request_id)
+            batch_metrics.add_count('Records', len(results) + len(failed_messages))
+            batch_metrics.add_count('FailedRecords', len(failed_messages))
+
+        if _cold_start:
+            _cold_start = False
+            log_with_context("Cold start report", startup_report(MODULE_IMPORT_MS), request_id=request_id)
 
         execution_time = time.time() - start_time
         log_with_context("Lambda execution completed", {
             "request_id": request_id,
             "execution_time": execution_time,
             "processed_count": len(results),
-            "failed_count": len(failed_messages)
+            "failed_count": len(failed_messages),
+            "session_cache": get_session_cache_stats()
         }, request_id=request_id)
 
-        return {
-            'statusCode': 200,
-            'body': json.dumps({
-                'processed': len(results),
-                'failed': len(failed_messages),
-                'results': results,
-                'failures': failed_messages,
-                'executionTime': execution_time
-            })
-        }
+        return build_batch_response(failed_messages)
 
     except Exception as e:
         log_with_context(
@@ -418,10 +1518,9 @@ def lambda_handler(event, context):
             error=e,
             request_id=request_id
         )
-        return {
-            'statusCode': 500,
-            'body': json.dumps({
-                'error': str(e),
-                'errorType': e.__class__.__name__
-            })
-        }
\ No newline at end of file
+        # Return the whole batch to the queue rather than acknowledging unprocessed records
+        return build_batch_response([
+            {'messageId': record.get('messageId')} for record in event.get('Records', [])
+        ])
+
+MODULE_IMPORT_MS = round((time.perf_counter() - _init_started) * 1000, 3)
@@ -0,0 +1,281 @@
+# local-seo-photo-status
+# API Gateway Lambda (GET): photo status for dashboard polling
+# Reads the localseo-photos records written by local-seo-save-photos-to-s3 and
+# local-seo-google-business-upload-corrected
+import time
+_init_started = time.perf_counter()
+
+import base64
+import heapq
+import json
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from localseo_aws import DYNAMODB_TABLE, configure_clients, get_client, photo_partition_keys, startup_report
+from localseo_images import THUMBNAIL_SIZES, thumbnail_key
+from localseo_logging import log_with_context
+from localseo_metrics import MetricsRecorder
+
+# Constants
+METRICS_SERVICE = "photo-status"
+STATUSES = ("PENDING", "COMPLETED", "FAILED")
+DEFAULT_PAGE_SIZE = 25
+MAX_PAGE_SIZE = 100
+RESPONSE_CACHE_TTL = 5  # Seconds a response is reused by this container and by browsers
+RESPONSE_CACHE_SIZE = 256  # Cached responses kept per warm container
+QUERY_CONCURRENCY = 8  # Partition queries in flight when records are write-sharded
+
+configure_clients(max_pool_connections=QUERY_CONCURRENCY)
+
+# Only the attributes the dashboard shows; the GBP result JSON is never read
+PROJECTION = "PK, SK, fileName, #status, completedAt, #error, contentHash"
+PROJECTION_NAMES = {"#status": "status", "#error": "error"}
+
+# Cleared after the first invocation logs the startup report
+_cold_start = True
+
+_response_cache = OrderedDict()
+_response_cache_lock = threading.Lock()
+
+# Pool for scatter-gather queries over sharded partitions, created on first use
+_query_pool = None
+_query_pool_lock = threading.Lock()
+
+class BadRequest(ValueError):
+    """Invalid query parameters, answered with a 400"""
+
+def thumbnail_keys(content_hash):
+    return {str(size): thumbnail_key(content_hash, size) for size in THUMBNAIL_SIZES}
+
+def encode_cursor(positions):
+    return base64.urlsafe_b64encode(json.dumps(positions, separators=(',', ':')).encode()).decode()
+
+def decode_cursor(cursor):
+    """Per-stream position: the last SK returned, or None once that stream is exhausted"""
+    try:
+        positions = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise BadRequest("Invalid cursor")
+    if not isinstance(positions, dict) or not all(
+        position is None or isinstance(position, str) for position in positions.values()
+    ):
+        raise BadRequest("Invalid cursor")
+    return positions
+
+def stream_id(status, partition_key):
+    """Cursor key for one status prefix in one partition"""
+    return f"{status}@{partition_key}"
+
+def _get_query_pool():
+    global _query_pool
+    if _query_pool is None:
+        with _query_pool_lock:
+            if _query_pool is None:
+                _query_pool = ThreadPoolExecutor(max_workers=QUERY_CONCURRENCY, thread_name_prefix="status-query")
+    return _query_pool
+
+def scatter(func, calls):
+    """Run func over argument tuples, in parallel when there is more than one"""
+    if len(calls) == 1:
+        return [func(*calls[0])]
+    return list(_get_query_pool().map(lambda call: func(*call), calls))
+
+def key_condition(status, since, until):
+    """Key condition for one status prefix; sort keys are {STATUS}#{uploadedAt}#{fileName}"""
+    if since or until:
+        # "~" sorts after every character used in timestamps and file names
+        return 'PK = :pk AND SK BETWEEN :low AND :high', {
+            ':low': {'S': f"{status}#{since or ''}"},
+            ':high': {'S': f"{status}#{until or ''}~" if until else f"{status}#~"}
+        }
+    return 'PK = :pk AND begins_with(SK, :prefix)', {':prefix': {'S': f"{status}#"}}
+
+def query_status(partition_key, status, since, until, limit, after_sk=None):
+    """Newest-first records for one status in one partition, starting after after_sk"""
+    condition, values = key_condition(status, since, until)
+    kwargs = {
+        'TableName': DYNAMODB_TABLE,
+        'KeyConditionExpression': condition,
+        'ExpressionAttributeValues': {':pk': {'S': partition_key}, **values},
+        'ProjectionExpression': PROJECTION,
+        'ExpressionAttributeNames': PROJECTION_NAMES,
+        'ScanIndexForward': False,
+        'Limit': limit
+    }
+    if after_sk:
+        kwargs['ExclusiveStartKey'] = {'PK': {'S': partition_key}, 'SK': {'S': after_sk}}
+    response = get_client('dynamodb').query(**kwargs)
+    return response.get('Items', []), 'LastEvaluatedKey' in response
+
+def count_partition(partition_key, status, since, until):
+    """Number of records with a status in one partition, counted server-side without returning items"""
+    condition, values = key_condition(status, since, until)
+    kwargs = {
+        'TableName': DYNAMODB_TABLE,
+        'KeyConditionExpression': condition,
+        'ExpressionAttributeValues': {':pk': {'S': partition_key}, **values},
+        'Select': 'COUNT'
+    }
+    total = 0
+    while True:
+        response = get_client('dynamodb').query(**kwargs)
+        total += response['Count']
+        if 'LastEvaluatedKey' not in response:
+            return total
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+def count_status(store_id, status, since, until):
+    """Number of records with a status across all of the store's partitions"""
+    return sum(scatter(count_partition, [
+        (partition_key, status, since, until) for partition_key in photo_partition_keys(store_id)
+    ]))
+
+def to_photo(item):
+    status, uploaded_at, file_name = item['SK']['S'].split('#', 2)
+    photo = {
+        "fileName": item.get('fileName', {}).get('S', file_name),
+        "status": item.get('status', {}).get('S', status),
+        "uploadedAt": uploaded_at,
+        "completedAt": item.get('completedAt', {}).get('S'),
+        "error": item.get('error', {}).get('S')
+    }
+    if 'contentHash' in item:
+        photo["thumbnails"] = thumbnail_keys(item['contentHash']['S'])
+    return photo
+
+def list_photos(store_id, statuses, since=None, until=None, limit=DEFAULT_PAGE_SIZE, cursor=None):
+    """One page of photos, newest upload first, merged across the requested statuses.
+
+    Each status is a separate sort-key prefix in each of the store's partitions
+    (one, or several when records are write-sharded), so every status/partition
+    stream is queried newest-first (at most limit items each, in parallel) and
+    the results are merged. The cursor records, per stream, the last sort key
+    handed out, so the next page resumes each stream exactly where this one stopped.
+    """
+    streams = {
+        stream_id(status, partition_key): (partition_key, status)
+        for status in statuses for partition_key in photo_partition_keys(store_id)
+    }
+    positions = decode_cursor(cursor) if cursor else {stream: "" for stream in streams}
+    if not set(positions) <= set(streams):
+        raise BadRequest("Invalid cursor")
+
+    active = [stream for stream in streams if positions.get(stream) is not None]
+    fetched = scatter(
+        lambda stream: query_status(*streams[stream], since, until, limit, positions[stream] or None),
+        [(stream,) for stream in active]
+    )
+    candidates = []
+    more = {}
+    for stream, (items, has_more) in zip(active, fetched):
+        more[stream] = has_more
+        candidates.extend(items)
+
+    # Sort keys differ only in their status prefix, so compare what follows it
+    page = heapq.nlargest(limit, candidates, key=lambda item: item['SK']['S'].split('#', 1)[1])
+    next_positions = {}
+    for stream in active:
+        partition_key, status = streams[stream]
+
+        def in_stream(item):
+            return item['PK']['S'] == partition_key and item['SK']['S'].startswith(f"{status}#")
+
+        returned = [item['SK']['S'] for item in page if in_stream(item)]
+        if returned:
+            next_positions[stream] = returned[-1]
+        else:
+            next_positions[stream] = positions[stream]
+        if len(returned) == sum(1 for item in candidates if in_stream(item)) and not more[stream]:
+            # Everything this stream had left is on this page
+            next_positions[stream] = None
+
+    has_more = any(position is not None for position in next_positions.values())
+    return {
+        "photos": [to_photo(item) for item in page],
+        "nextCursor": encode_cursor(next_positions) if has_more else None
+    }
+
+def parse_query(params):
+    """Validate query string parameters into list_photos arguments"""
+    store_id = params.get("storeId")
+    if not store_id:
+        raise BadRequest("storeId is required")
+
+    statuses = STATUSES
+    if params.get("status"):
+        statuses = tuple(status.strip().upper() for status in params["status"].split(","))
+        if not set(statuses) <= set(STATUSES):
+            raise BadRequest(f"status must be one or more of {', '.join(STATUSES)}")
+
+    try:
+        limit = int(params.get("limit", DEFAULT_PAGE_SIZE))
+    except ValueError:
+        raise BadRequest("limit must be a number")
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        raise BadRequest(f"limit must be between 1 and {MAX_PAGE_SIZE}")
+
+    return {
+        "store_id": store_id,
+        "statuses": statuses,
+        "since": params.get("since"),
+        "until": params.get("until"),
+        "limit": limit,
+        "cursor": params.get("cursor")
+    }
+
+def get_cached(key):
+    with _response_cache_lock:
+        entry = _response_cache.get(key)
+        if entry and time.monotonic() - entry[0] < RESPONSE_CACHE_TTL:
+            _response_cache.move_to_end(key)
+            return entry[1]
+        return None
+
+def put_cached(key, body):
+    with _response_cache_lock:
+        _response_cache[key] = (time.monotonic(), body)
+        _response_cache.move_to_end(key)
+        while len(_response_cache) > RESPONSE_CACHE_SIZE:
+            _response_cache.popitem(last=False)
+
+def lambda_handler(event, context):
+    """Lambda handler for GET photo status"""
+    global _cold_start
+    headers = {
+        "Content-Type": "application/json",
+        "Access-Control-Allow-Origin": "*",
+        "Cache-Control": f"max-age={RESPONSE_CACHE_TTL}"
+    }
+    try:
+        params = event.get("queryStringParameters") or {}
+        query = parse_query(params)
+        include_counts = params.get("counts") == "true"
+
+        cache_key = json.dumps([query, include_counts], sort_keys=True)
+        body = get_cached(cache_key)
+        if body is None:
+            with MetricsRecorder(METRICS_SERVICE, {"storeId": query["store_id"], "outcome": "miss"}) as metrics:
+                with metrics.timer('Query'):
+                    result = list_photos(**query)
+                if include_counts:
+                    with metrics.timer('Count'):
+                        result["counts"] = {
+                            status: count_status(query["store_id"], status, query["since"], query["until"])
+                            for status in query["statuses"]
+                        }
+            body = json.dumps(result)
+            put_cached(cache_key, body)
+
+        if _cold_start:
+            _cold_start = False
+            log_with_context("Cold start report", startup_report(MODULE_IMPORT_MS))
+
+        return {"statusCode": 200, "body": body, "headers": headers}
+
+    except BadRequest as e:
+        return {"statusCode": 400, "body": json.dumps({"error": str(e)}), "headers": headers}
+    except Exception as e:
+        log_with_context("Error in lambda_handler", level="error", error=e)
+        return {"statusCode": 500, "body": json.dumps({"error": str(e)}), "headers": headers}
+
+MODULE_IMPORT_MS = round((time.perf_counter() - _init_started) * 1000, 3)
@@ -4,189 +4,788 @@ API Gateway: street-lawyer-services
 arn:aws:execute-api:us-east-1:752567131183:x4iemzhvq5/*/POST/local-seo-save-photos-to-s3
 API endpoint: https://x4iemzhvq5.execute-api.us-east-1.amazonaws.com/PROD/local-seo-save-photos-to-s3
 '''
+import time
+_init_started = time.perf_counter()
 
 import json
-import boto3
 import base64
-import uuid
-from datetime import datetime
-from botocore.exceptions import ClientError
-import time
-
-# Initialize AWS clients
-s3 = boto3.client('s3')
-sqs = boto3.client('sqs')
-dynamodb = boto3.client('dynamodb')
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from urllib.parse import unquote_plus
+from botocore.exceptions import BotoCoreError, ClientError
+from localseo_aws import (
+    BUCKET_NAME, DIRECT_UPLOADS_FOLDER, DYNAMODB_TABLE, MAX_RETRIES, QUEUE_URL, RETRY_DELAY, configure_clients,
+    content_index_key, generate_file_key, get_client, is_transient_error, parse_file_key, photo_partition_key,
+    photo_sort_key, retry, startup_report
+)
+from localseo_logging import log_with_context
+from localseo_images import (
+    HEADER_BYTES, MAX_IMAGE_SIZE, MIN_IMAGE_SIZE, VALID_CONTENT_TYPES, InvalidImageError, inspect_image,
+    submit_recompress, submit_thumbnails, thumbnail_key, thumbnails_available
+)
+from localseo_metrics import MetricsRecorder, bind, count, timer
 
 # Constants
-BUCKET_NAME = "street-lawyer-services"
-BASE_PATH = "local-seo-photos/uploads"
-QUEUE_URL = "https://sqs.us-east-1.amazonaws.com/752567131183/LocalSEOMediaQueue"
-DYNAMODB_TABLE = "localseo-photos"
-MAX_RETRIES = 3
-RETRY_DELAY = 2  # Initial retry delay in seconds
+THUMBNAIL_CACHE_CONTROL = "public, max-age=31536000, immutable"  # Keys are content-addressed, so never stale
+METRICS_SERVICE = "save-photos"
+PRESIGNED_URL_EXPIRY = 900  # Seconds a presigned upload form stays valid
+BATCH_MAX_PHOTOS = 50  # Photos accepted per batch request
+BATCH_UPLOAD_CONCURRENCY = 8  # S3 puts in flight per batch request
+DYNAMODB_BATCH_SIZE = 25  # BatchWriteItem request limit
+SQS_BATCH_SIZE = 10  # SendMessageBatch entry limit
 
-def log_error(message, error):
-    print(f"{message}: {str(error)}")
+# AWS clients are built on first use by get_client, so the 400 path builds none;
+# their pools only need to cover the batch upload workers
+configure_clients(max_pool_connections=BATCH_UPLOAD_CONCURRENCY)
 
-def retry(func):
-    def wrapper(*args, **kwargs):
-        retries = 0
-        while retries < MAX_RETRIES:
-            try:
-                return func(*args, **kwargs)
-            except Exception as e:
-                retries += 1
-                log_error(f"Error in {func.__name__}, retrying {retries}/{MAX_RETRIES}", e)
-                if retries == MAX_RETRIES:
-                    raise e
-                time.sleep(RETRY_DELAY * retries)
-    return wrapper
-
-def generate_file_key(store_id, file_name):
-    return f"{BASE_PATH}/{store_id}/{uuid.uuid4()}-{file_name}"
+# Cleared after the first invocation logs the startup report
+_cold_start = True
+
+def log_error(message, error):
+    log_with_context(message, level="error", error=error)
 
 def decode_file_content(file_content):
     return base64.b64decode(file_content)
 
-@retry
+def decoded_length(file_content):
+    """Size of the decoded photo, computed without decoding"""
+    return len(file_content) // 4 * 3 - file_content[-2:].count('=')
+
+def validate_photo(file_content, content_type):
+    """Check a base64 photo against the GBP rules from its decoded header alone"""
+    header = base64.b64decode(file_content[:HEADER_BYTES // 3 * 4])
+    file_size = decoded_length(file_content)
+    return inspect_image(header, file_size, content_type, complete=len(header) >= file_size)
+
+def hash_file_content(decoded_file):
+    return hashlib.sha256(decoded_file).hexdigest()
+
+def _is_sha256_hex(value):
+    return isinstance(value, str) and len(value) == 64 and all(c in "0123456789abcdef" for c in value.lower())
+
 def upload_to_s3(file_key, decoded_file, content_type):
-    s3.put_object(
+    get_client('s3').put_object(
         Bucket=BUCKET_NAME,
         Key=file_key,
         Body=decoded_file,
         ContentType=content_type
     )
-    print(f"File saved successfully to S3 bucket: {BUCKET_NAME}, key: {file_key}")
-
-@retry
-def create_dynamodb_record(store_id, file_name, file_key):
-    timestamp = datetime.now().isoformat()
-    
-    # Check if the record already exists
-    response = dynamodb.query(
-        TableName=DYNAMODB_TABLE,
-        KeyConditionExpression='PK = :pk AND begins_with(SK, :sk_prefix)',
-        ExpressionAttributeValues={
-            ':pk': {'S': f"{store_id}#PHOTO"},
-            ':sk_prefix': {'S': f"PENDING#"},
-            ':fileName': {'S': file_name}
-        },
-        FilterExpression='fileName = :fileName'
-    )
-    
-    if response.get('Items'):
-        print(f"Record already exists for {file_name}")
-        return timestamp
+    log_with_context("File saved to S3", {"bucket": BUCKET_NAME, "file_key": file_key}, level="debug", sample=True)
 
-    # Create a new record if it doesn't exist
-    dynamodb.put_item(
+def pending_record_item(store_id, file_name, file_key, timestamp, content_hash=None):
+    item = {
+        'PK': {'S': photo_partition_key(store_id, file_key)},
+        'SK': {'S': photo_sort_key('PENDING', timestamp, file_name)},
+        'fileName': {'S': file_name},
+        'fileKey': {'S': file_key},
+        'uploadTimestamp': {'S': timestamp},
+        'status': {'S': 'PENDING'}
+    }
+    if content_hash:
+        # Lets the dashboard find the photo's thumbnails (thumbnail_key)
+        item['contentHash'] = {'S': content_hash}
+    return item
+
+@retry(only=is_transient_error)
+def put_pending_record(item):
+    """Conditionally put a PENDING record; False when that exact key already exists"""
+    try:
+        get_client('dynamodb').put_item(
+            TableName=DYNAMODB_TABLE,
+            Item=item,
+            ConditionExpression='attribute_not_exists(PK)'
+        )
+        return True
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        return False
+
+def create_dynamodb_record(store_id, file_name, file_key, timestamp=None, content_hash=None):
+    """Create the PENDING record in one round trip; return (uploadTimestamp, created).
+
+    The key is fixed before the first attempt, so a retried or repeated call for
+    the same upload finds its own record instead of writing a second one, and
+    created is False.
+    """
+    timestamp = timestamp or datetime.now().isoformat()
+    created = put_pending_record(pending_record_item(store_id, file_name, file_key, timestamp, content_hash))
+    if created:
+        log_with_context(f"DynamoDB record created for {file_name}", level="debug", sample=True)
+    else:
+        log_with_context(f"Record already exists for {file_name}", {"file_key": file_key})
+    return timestamp, created
+
+def delete_pending_record(store_id, file_name, file_key, timestamp):
+    """Remove a PENDING record whose upload never made it onto the queue"""
+    try:
+        get_client('dynamodb').delete_item(
+            TableName=DYNAMODB_TABLE,
+            Key={
+                'PK': {'S': photo_partition_key(store_id, file_key)},
+                'SK': {'S': photo_sort_key('PENDING', timestamp, file_name)}
+            }
+        )
+    except ClientError as e:
+        log_error(f"Failed to remove PENDING record for {file_name}", e)
+
+@retry(only=is_transient_error)
+def claim_content(content_hash, store_id, file_key, file_name):
+    """Index the photo's content for this store; return the existing fileKey if already indexed"""
+    try:
+        get_client('dynamodb').put_item(
+            TableName=DYNAMODB_TABLE,
+            Item={
+                **content_index_key(content_hash, store_id),
+                'fileKey': {'S': file_key},
+                'fileName': {'S': file_name},
+                'indexedAt': {'S': datetime.now().isoformat()}
+            },
+            ConditionExpression='attribute_not_exists(PK)',
+            ReturnValuesOnConditionCheckFailure='ALL_OLD'
+        )
+        return None
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'ConditionalCheckFailedException':
+            raise
+        existing = e.response.get('Item')
+        if existing is None:
+            existing = get_client('dynamodb').get_item(
+                TableName=DYNAMODB_TABLE,
+                Key=content_index_key(content_hash, store_id),
+                ConsistentRead=True
+            ).get('Item', {})
+        return existing.get('fileKey', {}).get('S', file_key)
+
+def find_content(content_hash, store_id):
+    """Return the fileKey already indexed for this content and store, if any"""
+    item = get_client('dynamodb').get_item(
         TableName=DYNAMODB_TABLE,
-        Item={
-            'PK': {'S': f"{store_id}#PHOTO"},
-            'SK': {'S': f"PENDING#{timestamp}#{file_name}"},
-            'fileName': {'S': file_name},
-            'fileKey': {'S': file_key},
-            'uploadTimestamp': {'S': timestamp},
-            'status': {'S': 'PENDING'}
-        }
-    )
-    print(f"DynamoDB record created for {file_name}")
-    return timestamp
+        Key=content_index_key(content_hash, store_id)
+    ).get('Item')
+    return item['fileKey']['S'] if item else None
+
+def release_content(content_hash, store_id):
+    """Drop a content claim whose upload never made it onto the queue"""
+    try:
+        get_client('dynamodb').delete_item(
+            TableName=DYNAMODB_TABLE,
+            Key=content_index_key(content_hash, store_id)
+        )
+    except ClientError as e:
+        log_error(f"Failed to release content claim for {store_id}", e)
+
+def store_thumbnails(content_hash, future):
+    """Write the thumbnails rendered by future; best effort, so a failure never fails the upload.
+
+    Keys are content-addressed and written with If-None-Match, so the same photo
+    uploaded for another store (or retried) never rewrites them.
+    """
+    if future is None:
+        return
+    try:
+        with timer('Thumbnails'):
+            thumbnails = future.result()
+            for size, data in thumbnails.items():
+                try:
+                    get_client('s3').put_object(
+                        Bucket=BUCKET_NAME,
+                        Key=thumbnail_key(content_hash, size),
+                        Body=data,
+                        ContentType='image/webp',
+                        CacheControl=THUMBNAIL_CACHE_CONTROL,
+                        IfNoneMatch='*'
+                    )
+                except ClientError as e:
+                    if e.response['Error']['Code'] not in ('PreconditionFailed', 'ConditionalRequestConflict'):
+                        raise
+        count('Thumbnails', len(thumbnails))
+    except Exception as e:
+        count('ThumbnailFailures')
+        log_with_context("Thumbnail generation failed", {"content_hash": content_hash}, level="warning", error=e)
 
-@retry
-def send_message_to_sqs(file_key, file_name, store_id, content_type, timestamp):
+def sqs_message_body(file_key, file_name, store_id, content_type, timestamp, file_size=None, content_hash=None,
+                     store_ids=None):
     message_body = {
         "fileKey": file_key,
         "fileName": file_name,
         "storeId": store_id,
         "contentType": content_type,
-        "uploadedAt": timestamp
+        "uploadedAt": timestamp,
+        "fileSize": file_size,
+        "contentHash": content_hash,
+        # The record's partition, which depends on PHOTO_SHARDS when it was written
+        "partitionKey": photo_partition_key(store_id, file_key)
+    }
+    if store_ids:
+        # Fan-out: the upload Lambda posts this one object to every listed location
+        message_body["storeIds"] = store_ids
+    return message_body
+
+def sqs_message_attributes(store_id):
+    return {
+        'storeId': {
+            'DataType': 'String',
+            'StringValue': store_id
+        }
     }
-    
-    sqs_response = sqs.send_message(
+
+def send_message_to_sqs(file_key, file_name, store_id, content_type, timestamp, file_size=None, content_hash=None,
+                        store_ids=None):
+    message_body = sqs_message_body(
+        file_key, file_name, store_id, content_type, timestamp, file_size, content_hash, store_ids
+    )
+    sqs_response = get_client('sqs').send_message(
         QueueUrl=QUEUE_URL,
         MessageBody=json.dumps(message_body),
-        MessageAttributes={
-            'storeId': {
-                'DataType': 'String',
-                'StringValue': store_id
+        MessageAttributes=sqs_message_attributes(store_id)
+    )
+    log_with_context("Message sent to SQS", {"message_id": sqs_response['MessageId']}, level="debug", sample=True)
+
+def save_photo_to_s3(file_name, file_content, content_type, store_id, store_ids=None):
+    """Save the photo to the correct folder in S3 and create a DynamoDB record.
+
+    Returns (file_key, duplicate). A photo whose content was already uploaded for
+    this store is not stored or queued again; the earlier upload's key is returned.
+    """
+    with MetricsRecorder(METRICS_SERVICE, {"storeId": store_id, "outcome": "success"}) as metrics:
+        content_hash = None
+        try:
+            file_key = generate_file_key(store_id, file_name)
+
+            if not file_key:
+                raise ValueError("Generated fileKey is empty or invalid.")
+            
+            # Header-only checks: a photo GBP would reject fails here, before any AWS call
+            with metrics.timer('ImageValidation'):
+                image = validate_photo(file_content, content_type)
+            with metrics.timer('Base64Decode'):
+                decoded_file = decode_file_content(file_content)
+            if image['oversized']:
+                with metrics.timer('Recompress'):
+                    decoded_file = submit_recompress(decoded_file).result()
+                count('RecompressedPhotos')
+                content_type = 'image/jpeg'
+            file_size = len(decoded_file)
+
+            with metrics.timer('ContentHash'):
+                digest = hash_file_content(decoded_file)
+            with metrics.timer('ContentIndex'):
+                existing_key = claim_content(digest, store_id, file_key, file_name)
+            if existing_key:
+                metrics.set_dimension('outcome', 'duplicate')
+                count('DuplicateUploads')
+                log_with_context("Duplicate photo, reusing earlier upload", {
+                    "store_id": store_id,
+                    "file_key": existing_key,
+                    "content_hash": digest
+                })
+                return existing_key, True
+            content_hash = digest
+
+            # Rendered on the CPU pool while the photo is stored, recorded and queued
+            thumbnails = submit_thumbnails(decoded_file)
+            with metrics.timer('S3PutObject'):
+                upload_to_s3(file_key, decoded_file, content_type)
+            with metrics.timer('DynamoDBWrite'):
+                timestamp, _ = create_dynamodb_record(store_id, file_name, file_key, content_hash=content_hash)
+            with metrics.timer('SqsSendMessage'):
+                send_message_to_sqs(
+                    file_key, file_name, store_id, content_type, timestamp, file_size, content_hash, store_ids
+                )
+            store_thumbnails(content_hash, thumbnails)
+
+            return file_key, False
+            
+        except InvalidImageError as e:
+            metrics.set_dimension('outcome', 'invalid')
+            log_with_context("Photo rejected", {"file_name": file_name, "store_id": store_id}, level="warning", error=e)
+            raise
+        except Exception as e:
+            metrics.set_dimension('outcome', 'failure')
+            log_error("Error in save_photo_to_s3", e)
+            if content_hash:
+                # Nothing was queued, so a retry of the same photo must not be treated as a duplicate
+                release_content(content_hash, store_id)
+            raise e
+
+def _is_store_list(value):
+    return isinstance(value, list) and bool(value) and all(isinstance(item, str) and item for item in value)
+
+def claim_contents(claims):
+    """Claim content index entries for many photos in one transaction.
+
+    claims is a list of (content_hash, store_id, file_key, file_name). Returns
+    {index: existing_file_key} for the photos that are duplicates. A cancelled
+    transaction reports which claims already existed, so they are dropped and the
+    rest claimed again: one round trip when nothing is a duplicate, two otherwise.
+    """
+    duplicates = {}
+    pending = list(range(len(claims)))
+    while pending:
+        try:
+            with timer('ContentIndex'):
+                get_client('dynamodb').transact_write_items(TransactItems=[{
+                    'Put': {
+                        'TableName': DYNAMODB_TABLE,
+                        'Item': {
+                            **content_index_key(claims[index][0], claims[index][1]),
+                            'fileKey': {'S': claims[index][2]},
+                            'fileName': {'S': claims[index][3]},
+                            'indexedAt': {'S': datetime.now().isoformat()}
+                        },
+                        'ConditionExpression': 'attribute_not_exists(PK)',
+                        'ReturnValuesOnConditionCheckFailure': 'ALL_OLD'
+                    }
+                } for index in pending])
+            return duplicates
+        except ClientError as e:
+            if e.response['Error']['Code'] != 'TransactionCanceledException':
+                raise
+            reasons = e.response.get('CancellationReasons', [])
+            failed = [
+                (index, reason) for index, reason in zip(pending, reasons)
+                if reason.get('Code') == 'ConditionalCheckFailed'
+            ]
+            if not failed:
+                # Cancelled for another reason (conflict, throttling); let the caller fail the batch
+                raise
+            for index, reason in failed:
+                existing = reason.get('Item', {}).get('fileKey', {}).get('S')
+                duplicates[index] = existing or find_content(claims[index][0], claims[index][1])
+            pending = [index for index in pending if index not in duplicates]
+    return duplicates
+
+def batch_write_records(items):
+    """Write PENDING records with BatchWriteItem; return the items that could not be written.
+
+    A call that still fails after botocore's retries leaves its whole group unwritten
+    rather than raising, so the caller can release the claims of exactly those photos.
+    """
+    unwritten = []
+    for start in range(0, len(items), DYNAMODB_BATCH_SIZE):
+        requests = [{'PutRequest': {'Item': item}} for item in items[start:start + DYNAMODB_BATCH_SIZE]]
+        for attempt in range(MAX_RETRIES):
+            try:
+                response = get_client('dynamodb').batch_write_item(RequestItems={DYNAMODB_TABLE: requests})
+            except (BotoCoreError, ClientError) as e:
+                log_error("BatchWriteItem failed", e)
+                break
+            requests = response.get('UnprocessedItems', {}).get(DYNAMODB_TABLE, [])
+            if not requests:
+                break
+            if attempt < MAX_RETRIES - 1:
+                count('Retries')
+                time.sleep(RETRY_DELAY * (attempt + 1))
+        unwritten.extend(request['PutRequest']['Item'] for request in requests)
+    return unwritten
+
+def send_message_batch(entries):
+    """Enqueue messages with SendMessageBatch; return the Ids that could not be sent.
+
+    As in batch_write_records, a call that fails outright counts its whole group as unsent.
+    """
+    failed = set()
+    for start in range(0, len(entries), SQS_BATCH_SIZE):
+        batch = entries[start:start + SQS_BATCH_SIZE]
+        for attempt in range(MAX_RETRIES):
+            try:
+                response = get_client('sqs').send_message_batch(QueueUrl=QUEUE_URL, Entries=batch)
+            except (BotoCoreError, ClientError) as e:
+                log_error("SendMessageBatch failed", e)
+                break
+            # Sender faults (bad entries) will not succeed on a retry
+            retryable = {item['Id'] for item in response.get('Failed', []) if not item.get('SenderFault')}
+            failed.update(item['Id'] for item in response.get('Failed', []) if item.get('SenderFault'))
+            batch = [entry for entry in batch if entry['Id'] in retryable]
+            if not batch:
+                break
+            if attempt < MAX_RETRIES - 1:
+                count('Retries')
+                time.sleep(RETRY_DELAY * (attempt + 1))
+        failed.update(entry['Id'] for entry in batch)
+    return failed
+
+def save_photo_batch(photos):
+    """Save many base64 photos in one request and return a status per photo.
+
+    S3 puts run concurrently; content claims, records and messages are written in
+    bulk (TransactWriteItems, BatchWriteItem, SendMessageBatch). Each result has
+    the photo's index, fileName and a status of uploaded, duplicate, invalid or failed.
+    """
+    results = [{"index": index, "fileName": (photo or {}).get("fileName")} for index, photo in enumerate(photos)]
+    with MetricsRecorder(METRICS_SERVICE, {"storeId": "batch", "outcome": "batch"}) as metrics:
+        metrics.add_count('Photos', len(photos))
+
+        # Validate from headers and decode; anything malformed is reported and left out of the batch
+        accepted = []
+        for index, photo in enumerate(photos):
+            if not isinstance(photo, dict) or not all(
+                photo.get(field) for field in ("fileName", "fileContent", "contentType", "storeId")
+            ):
+                results[index].update(status="invalid", error="Missing required parameters")
+                continue
+            if photo.get("storeIds") is not None and not _is_store_list(photo["storeIds"]):
+                results[index].update(status="invalid", error="storeIds must be a non-empty list of store IDs")
+                continue
+            try:
+                with metrics.timer('ImageValidation'):
+                    image = validate_photo(photo["fileContent"], photo["contentType"])
+                with metrics.timer('Base64Decode'):
+                    decoded_file = decode_file_content(photo["fileContent"])
+            except ValueError as e:
+                # InvalidImageError and malformed base64 alike
+                results[index].update(status="invalid", error=str(e))
+                continue
+            entry = {
+                "index": index,
+                "photo": photo,
+                "data": decoded_file,
+                "content_type": photo["contentType"],
+                "file_key": generate_file_key(photo["storeId"], photo["fileName"])
             }
-        }
+            if image['oversized']:
+                # Runs on the CPU pool while the remaining photos are validated
+                entry["recompress"] = submit_recompress(decoded_file)
+            accepted.append(entry)
+
+        for entry in list(accepted):
+            future = entry.pop("recompress", None)
+            if future is not None:
+                try:
+                    with metrics.timer('Recompress'):
+                        entry["data"] = future.result()
+                except InvalidImageError as e:
+                    results[entry["index"]].update(status="invalid", error=str(e))
+                    accepted.remove(entry)
+                    continue
+                entry["content_type"] = 'image/jpeg'
+                count('RecompressedPhotos')
+            entry["digest"] = hash_file_content(entry["data"])
+
+        # The same photo twice for one store in one request is a duplicate of the first
+        first_seen = {}
+        claims = []
+        for entry in list(accepted):
+            claim_key = (entry["digest"], entry["photo"]["storeId"])
+            if claim_key in first_seen:
+                results[entry["index"]].update(status="duplicate", fileKey=first_seen[claim_key]["file_key"])
+                accepted.remove(entry)
+                continue
+            first_seen[claim_key] = entry
+            claims.append((entry["digest"], entry["photo"]["storeId"], entry["file_key"], entry["photo"]["fileName"]))
+
+        if claims:
+            duplicates = claim_contents(claims)
+            for position, existing_key in duplicates.items():
+                results[accepted[position]["index"]].update(status="duplicate", fileKey=existing_key)
+            accepted = [entry for position, entry in enumerate(accepted) if position not in duplicates]
+
+        for entry in accepted:
+            entry["thumbnails"] = submit_thumbnails(entry["data"])
+
+        def fail(entry, error):
+            results[entry["index"]].update(status="failed", error=str(error))
+            release_content(entry["digest"], entry["photo"]["storeId"])
+
+        # S3 puts concurrently; the client retries each one
+        def put(entry):
+            with bind(metrics), metrics.timer('S3PutObject'):
+                upload_to_s3(entry["file_key"], entry["data"], entry["content_type"])
+
+        stored = []
+        if accepted:
+            with ThreadPoolExecutor(max_workers=min(BATCH_UPLOAD_CONCURRENCY, len(accepted))) as pool:
+                futures = [(entry, pool.submit(put, entry)) for entry in accepted]
+            for entry, future in futures:
+                try:
+                    future.result()
+                    stored.append(entry)
+                except Exception as e:
+                    fail(entry, e)
+
+        # Records in bulk; microsecond offsets keep sort keys unique within the request
+        base_time = datetime.now()
+        for offset, entry in enumerate(stored):
+            entry["timestamp"] = (base_time + timedelta(microseconds=offset)).isoformat()
+            entry["item"] = pending_record_item(
+                entry["photo"]["storeId"], entry["photo"]["fileName"], entry["file_key"], entry["timestamp"],
+                entry["digest"]
+            )
+        with metrics.timer('DynamoDBBatchWrite'):
+            unwritten = batch_write_records([entry["item"] for entry in stored])
+        unwritten_keys = {(item['PK']['S'], item['SK']['S']) for item in unwritten}
+        recorded = []
+        for entry in stored:
+            if (entry["item"]['PK']['S'], entry["item"]['SK']['S']) in unwritten_keys:
+                fail(entry, "DynamoDB write was not processed")
+            else:
+                recorded.append(entry)
+
+        # Messages in groups of SQS_BATCH_SIZE
+        entries = []
+        for entry in recorded:
+            photo = entry["photo"]
+            entries.append({
+                'Id': str(entry["index"]),
+                'MessageBody': json.dumps(sqs_message_body(
+                    entry["file_key"], photo["fileName"], photo["storeId"], entry["content_type"],
+                    entry["timestamp"], len(entry["data"]), entry["digest"], photo.get("storeIds")
+                )),
+                'MessageAttributes': sqs_message_attributes(photo["storeId"])
+            })
+        with metrics.timer('SqsSendMessageBatch'):
+            unsent = send_message_batch(entries)
+        for entry in recorded:
+            if str(entry["index"]) in unsent:
+                fail(entry, "SQS message was not sent")
+                delete_pending_record(
+                    entry["photo"]["storeId"], entry["photo"]["fileName"], entry["file_key"], entry["timestamp"]
+                )
+            else:
+                results[entry["index"]].update(status="uploaded", fileKey=entry["file_key"])
+                store_thumbnails(entry["digest"], entry["thumbnails"])
+
+        outcomes = [result.get("status") for result in results]
+        metrics.add_count('DuplicateUploads', outcomes.count("duplicate"))
+        metrics.add_count('FailedPhotos', outcomes.count("failed") + outcomes.count("invalid"))
+        return results
+
+def create_presigned_upload(file_name, content_type, store_id, store_ids=None, content_sha256=None):
+    """Issue a presigned POST so the browser uploads straight to S3.
+
+    The POST policy pins the key, Content-Type and size range. When the client
+    sends the photo's SHA-256 (hex), S3 verifies it on upload and a photo already
+    indexed for the store is reported as a duplicate without issuing a form.
+    The DynamoDB record and SQS message are written by finalize_direct_uploads
+    once the object exists.
+    """
+    if content_sha256:
+        existing_key = find_content(content_sha256, store_id)
+        if existing_key:
+            count('DuplicateUploads')
+            return {"fileKey": existing_key, "duplicate": True}
+
+    file_key = generate_file_key(store_id, file_name, DIRECT_UPLOADS_FOLDER)
+    fields = {'Content-Type': content_type}
+    if store_ids:
+        fields['x-amz-meta-store-ids'] = ",".join(store_ids)
+    if content_sha256:
+        fields['x-amz-checksum-algorithm'] = 'SHA256'
+        fields['x-amz-checksum-sha256'] = base64.b64encode(bytes.fromhex(content_sha256)).decode()
+    conditions = [{name: value} for name, value in fields.items()]
+    conditions.append(["content-length-range", MIN_IMAGE_SIZE, MAX_IMAGE_SIZE])
+
+    post = get_client('s3').generate_presigned_post(
+        Bucket=BUCKET_NAME,
+        Key=file_key,
+        Fields=fields,
+        Conditions=conditions,
+        ExpiresIn=PRESIGNED_URL_EXPIRY
     )
-    print(f"Message sent to SQS successfully: {sqs_response['MessageId']}")
+    return {
+        "fileKey": file_key,
+        "duplicate": False,
+        "uploadUrl": post['url'],
+        "fields": post['fields'],
+        "expiresIn": PRESIGNED_URL_EXPIRY
+    }
 
-def save_photo_to_s3(file_name, file_content, content_type, store_id):
-    """Save the photo to the correct folder in S3 and create a DynamoDB record."""
-    try:
-        print(f"Starting save_photo_to_s3: fileName={file_name}, storeId={store_id}, contentType={content_type}")
-        
-        file_key = generate_file_key(store_id, file_name)
-        print(f"Generated fileKey: {file_key}")
-
-        if not file_key:
-            raise ValueError("Generated fileKey is empty or invalid.")
-        
-        decoded_file = decode_file_content(file_content)
-        print(f"Decoded file content successfully for {file_name}")
-
-        upload_to_s3(file_key, decoded_file, content_type)
-        timestamp = create_dynamodb_record(store_id, file_name, file_key)
-        send_message_to_sqs(file_key, file_name, store_id, content_type, timestamp)
-
-        return file_key
-        
-    except Exception as e:
-        log_error("Error in save_photo_to_s3", e)
-        raise e
+def finalize_direct_upload(file_key, event_time=None):
+    """Record and queue one presigned upload once S3 reports the object created"""
+    parsed = parse_file_key(file_key, DIRECT_UPLOADS_FOLDER)
+    if parsed is None:
+        log_with_context("Ignoring object outside the direct upload prefix", {"file_key": file_key}, level="warning")
+        return
+    store_id, file_name = parsed
+
+    with MetricsRecorder(METRICS_SERVICE, {"storeId": store_id, "outcome": "finalized"}) as metrics:
+        try:
+            with metrics.timer('S3HeadObject'):
+                head = get_client('s3').head_object(Bucket=BUCKET_NAME, Key=file_key, ChecksumMode='ENABLED')
+            store_ids = [item for item in head.get('Metadata', {}).get('store-ids', '').split(',') if item]
+
+            # The POST policy only pins the declared type and size; check the bytes themselves.
+            # Thumbnails need the whole photo (at most MAX_IMAGE_SIZE), otherwise the header will do
+            full_object = thumbnails_available()
+            with metrics.timer('ImageValidation'):
+                content = get_client('s3').get_object(
+                    Bucket=BUCKET_NAME, Key=file_key,
+                    **({} if full_object else {'Range': f"bytes=0-{HEADER_BYTES - 1}"})
+                )['Body'].read()
+                try:
+                    inspect_image(
+                        content, head['ContentLength'], head.get('ContentType'),
+                        complete=len(content) >= head['ContentLength']
+                    )
+                except InvalidImageError as e:
+                    metrics.set_dimension('outcome', 'invalid')
+                    get_client('s3').delete_object(Bucket=BUCKET_NAME, Key=file_key)
+                    log_with_context("Invalid direct upload removed", {"file_key": file_key}, level="warning", error=e)
+                    return
+
+            content_hash = None
+            digest = None
+            if head.get('ChecksumSHA256'):
+                digest = base64.b64decode(head['ChecksumSHA256']).hex()
+            elif full_object:
+                digest = hash_file_content(content)
+            thumbnails = None
+            if digest:
+                with metrics.timer('ContentIndex'):
+                    existing_key = claim_content(digest, store_id, file_key, file_name)
+                # S3 can deliver the same event twice; our own claim is not a duplicate
+                if existing_key and existing_key != file_key:
+                    metrics.set_dimension('outcome', 'duplicate')
+                    count('DuplicateUploads')
+                    get_client('s3').delete_object(Bucket=BUCKET_NAME, Key=file_key)
+                    log_with_context("Duplicate direct upload removed", {
+                        "file_key": file_key,
+                        "existing_key": existing_key
+                    })
+                    return
+                content_hash = digest
+                if full_object:
+                    thumbnails = submit_thumbnails(content)
+
+            with metrics.timer('DynamoDBWrite'):
+                # The event time is the same on a redelivered event, so the record key is too
+                timestamp, created = create_dynamodb_record(store_id, file_name, file_key, event_time, content_hash)
+            if not created:
+                # The first delivery of this event already queued the upload
+                metrics.set_dimension('outcome', 'redelivered')
+                log_with_context("Direct upload already finalized", {"file_key": file_key, "store_id": store_id})
+                return
+            try:
+                with metrics.timer('SqsSendMessage'):
+                    send_message_to_sqs(
+                        file_key, file_name, store_id, head.get('ContentType', 'application/octet-stream'),
+                        timestamp, head.get('ContentLength'), content_hash, store_ids or None
+                    )
+            except Exception:
+                # Otherwise the retried event would find the record and never queue the upload
+                delete_pending_record(store_id, file_name, file_key, timestamp)
+                raise
+            store_thumbnails(content_hash, thumbnails)
+            log_with_context("Direct upload finalized", {"file_key": file_key, "store_id": store_id})
+
+        except Exception as e:
+            metrics.set_dimension('outcome', 'failure')
+            log_error(f"Error finalizing direct upload {file_key}", e)
+            raise e
+
+def s3_event_timestamp(event_time):
+    """Convert an S3 eventTime (UTC, "Z" suffix) to the naive ISO format used in sort keys"""
+    if not event_time:
+        return None
+    return datetime.fromisoformat(event_time.replace('Z', '+00:00')).replace(tzinfo=None).isoformat()
+
+def finalize_direct_uploads(records):
+    """Handle an S3 ObjectCreated event; raising makes Lambda retry the event"""
+    failures = 0
+    for record in records:
+        file_key = unquote_plus(record['s3']['object']['key'])
+        try:
+            finalize_direct_upload(file_key, s3_event_timestamp(record.get('eventTime')))
+        except Exception:
+            failures += 1
+    if failures:
+        # Finalizing is idempotent, so retrying the records that already succeeded is safe
+        raise RuntimeError(f"Failed to finalize {failures} of {len(records)} direct uploads")
+    return {"finalized": len(records)}
+
+def response(status_code, body):
+    """API Gateway response with the CORS headers; the first one also logs the cold start report"""
+    global _cold_start
+    if _cold_start:
+        _cold_start = False
+        log_with_context("Cold start report", startup_report(MODULE_IMPORT_MS))
+    return {
+        "statusCode": status_code,
+        "body": json.dumps(body),
+        "headers": {
+            "Content-Type": "application/json",
+            "Access-Control-Allow-Origin": "*"
+        }
+    }
 
 def lambda_handler(event, context):
-    """Lambda handler for saving photos to S3."""
+    """Lambda handler for saving photos to S3.
+
+    Handles four kinds of event: API requests carrying the photo as base64
+    (fileContent), batch API requests carrying a list of such photos (photos),
+    API requests for a presigned upload form (uploadMode "presigned"), and S3
+    ObjectCreated notifications for finished presigned uploads.
+    """
+    if event.get("Records"):
+        return finalize_direct_uploads(event["Records"])
+
     try:
-        print(f"Lambda invoked with event: {json.dumps(event)}")
+        # fileContent is redacted by the logger, so the base64 payload is never serialized
+        log_with_context("Lambda invoked", {"event": event}, level="debug")
+
+        if "photos" in event:
+            photos = event["photos"]
+            if not isinstance(photos, list) or not photos or len(photos) > BATCH_MAX_PHOTOS:
+                return response(400, {"error": f"photos must be a list of 1 to {BATCH_MAX_PHOTOS} photos"})
+            results = save_photo_batch(photos)
+            summary = {}
+            for result in results:
+                summary[result["status"]] = summary.get(result["status"], 0) + 1
+            log_with_context("Batch processed", {"photos": len(photos), "summary": summary})
+            return response(200, {"results": results, "summary": summary})
 
         # Parse the request body
         file_name = event.get("fileName")
         file_content = event.get("fileContent")  # Expecting base64-encoded content
         content_type = event.get("contentType")
         store_id = event.get("storeId")
-
-        print(f"file_name: {file_name}")
+        store_ids = event.get("storeIds")  # Optional: post to these locations instead of storeId's alone
+        presigned = event.get("uploadMode") == "presigned"
 
         # Validate inputs
-        if not all([file_name, file_content, content_type, store_id]):
-            print(f"Missing parameters: fileName={file_name}, fileContent={'present' if file_content else 'missing'}, contentType={content_type}, storeId={store_id}")
-            return {
-                "statusCode": 400,
-                "body": json.dumps({"error": "Missing required parameters"})
-            }
+        if not all([file_name, file_content or presigned, content_type, store_id]):
+            log_with_context("Missing parameters", {
+                "fileName": file_name,
+                "fileContentPresent": bool(file_content),
+                "contentType": content_type,
+                "storeId": store_id
+            }, level="warning")
+            return response(400, {"error": "Missing required parameters"})
+        if store_ids is not None and not _is_store_list(store_ids):
+            return response(400, {"error": "storeIds must be a non-empty list of store IDs"})
 
-        print("All required parameters present. Proceeding with S3 save.")
+        if presigned:
+            content_sha256 = (event.get("contentSha256") or "").lower() or None
+            if content_type not in VALID_CONTENT_TYPES or "/" in store_id or (
+                content_sha256 and not _is_sha256_hex(content_sha256)
+            ):
+                return response(400, {"error": "Unsupported contentType, storeId or contentSha256"})
+            upload = create_presigned_upload(file_name, content_type, store_id, store_ids, content_sha256)
+            log_with_context("Presigned upload issued", {
+                "file_key": upload["fileKey"],
+                "store_id": store_id,
+                "duplicate": upload["duplicate"]
+            })
+            return response(200, upload)
 
         # Save the photo to S3 and queue the media upload
-        file_key = save_photo_to_s3(file_name, file_content, content_type, store_id)
+        try:
+            file_key, duplicate = save_photo_to_s3(file_name, file_content, content_type, store_id, store_ids)
+        except InvalidImageError as e:
+            return response(400, {"error": str(e)})
 
         # Return success response
-        print(f"File successfully uploaded to S3 with key: {file_key}")
-        return {
-            "statusCode": 200,
-            "body": json.dumps({
-                "message": "File uploaded successfully",
-                "fileKey": file_key
-            }),
-            "headers": {
-                "Content-Type": "application/json",
-                "Access-Control-Allow-Origin": "*"
-            }
-        }
+        log_with_context("File uploaded", {"file_key": file_key, "store_id": store_id, "duplicate": duplicate})
+        return response(200, {
+            "message": "File already uploaded" if duplicate else "File uploaded successfully",
+            "fileKey": file_key,
+            "duplicate": duplicate
+        })
 
     except Exception as e:
         log_error("Error in lambda_handler", e)
-        return {
-            "statusCode": 500,
-            "body": json.dumps({"error": str(e)}),
-            "headers": {
-                "Content-Type": "application/json",
-                "Access-Control-Allow-Origin": "*"
-            }
-        }
\ No newline at end of file
+        return response(500, {"error": str(e)})
+
+MODULE_IMPORT_MS = round((time.perf_counter() - _init_started) * 1000, 3)
@@ -0,0 +1,217 @@
+'''
+Lazily constructed, memoized AWS clients shared by the local SEO photo Lambdas,
+plus the resource names, the S3 and DynamoDB key schema and the retry helper
+they have in common.
+Every localseo_* module (this one, localseo_logging, localseo_metrics and
+localseo_images) is deployed alongside each Lambda handler, or in a shared layer.
+
+Clients are built on first use rather than at import, so cold starts only pay
+for the clients an invocation actually needs, and the time spent building each
+one (or importing any other lazy dependency) is recorded for the startup report.
+
+Every client shares one botocore Config: a connection pool sized by
+configure_clients to the handler's concurrency (botocore's default of 10 makes
+worker threads queue for a connection), "standard" retries, which already cover
+throttling, 5xx and connection errors with jittered backoff, TCP keep-alive, and
+short connect and read timeouts so a slow endpoint fails the call instead of
+holding the invocation.
+
+Environment variables:
+AWS_RETRY_MODE            "standard" (default) or "adaptive", which also rate-limits
+                          the client after throttling responses
+AWS_MAX_ATTEMPTS          Attempts per call including the first (default 3)
+AWS_CONNECT_TIMEOUT       Seconds to establish a connection (default 2)
+AWS_READ_TIMEOUT          Seconds to wait for response data (default 10; S3 gets
+                          S3_READ_TIMEOUT since copies and parts move whole objects)
+AWS_MAX_POOL_CONNECTIONS  Overrides the pool size the handlers ask for
+PHOTO_SHARDS              Partitions each store's photo records are spread over
+                          (default 1, unsharded); see photo_partition_key
+'''
+import os
+import threading
+import time
+import uuid
+import zlib
+from contextlib import contextmanager
+from functools import wraps
+
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError
+
+from localseo_logging import log_with_context
+from localseo_metrics import count
+
+# Shared resources
+BUCKET_NAME = "street-lawyer-services"
+QUEUE_URL = "https://sqs.us-east-1.amazonaws.com/752567131183/LocalSEOMediaQueue"
+DYNAMODB_TABLE = "localseo-photos"
+PHOTO_SHARDS = int(os.environ.get('PHOTO_SHARDS', '1'))  # Raise, never lower, while records remain in higher shards
+
+# Photo objects are "{folder}/{storeId}/{uuid4}-{fileName}" and keep that tail as they move between folders
+UPLOADS_FOLDER = "local-seo-photos/uploads"
+# Presigned uploads; the bucket's ObjectCreated notification is filtered on this prefix,
+# so nothing else may write under it
+DIRECT_UPLOADS_FOLDER = f"{UPLOADS_FOLDER}/direct"
+PROCESSED_FOLDER = "local-seo-photos/processed"
+ERRORS_FOLDER = "local-seo-photos/errors"
+OBJECT_ID_LENGTH = 37  # The "{uuid4}-" prefix of every object name
+
+# Client configuration
+AWS_RETRY_MODE = os.environ.get('AWS_RETRY_MODE', 'standard')
+AWS_MAX_ATTEMPTS = int(os.environ.get('AWS_MAX_ATTEMPTS', '3'))
+AWS_CONNECT_TIMEOUT = float(os.environ.get('AWS_CONNECT_TIMEOUT', '2'))
+AWS_READ_TIMEOUT = float(os.environ.get('AWS_READ_TIMEOUT', '10'))
+S3_READ_TIMEOUT = 30  # Seconds; CopyObject and part uploads respond only once the data has moved
+DEFAULT_MAX_POOL_CONNECTIONS = 10  # botocore's default, the floor for configure_clients
+
+# Application-level retries, only for errors botocore's retry mode does not cover;
+# throttling, 5xx responses, timeouts and connection errors are retried by the clients
+MAX_RETRIES = 3
+RETRY_DELAY = 2  # Initial retry delay in seconds, doubled per retry
+TRANSIENT_ERROR_CODES = {'TransactionConflictException'}  # A write raced a transaction on the same item
+
+_clients = {}
+_clients_lock = threading.Lock()
+_max_pool_connections = int(os.environ.get('AWS_MAX_POOL_CONNECTIONS', '0')) or DEFAULT_MAX_POOL_CONNECTIONS
+
+# Milliseconds spent on each lazy initialization (clients, deferred imports)
+init_timings = {}
+
+@contextmanager
+def timed_init(name):
+    """Record how long a one-off initialization takes"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        init_timings[name] = round((time.perf_counter() - start) * 1000, 3)
+
+def configure_clients(max_pool_connections):
+    """Size client connection pools to the caller's concurrency; call at module import.
+
+    Only ever grows the pool (several handlers can share a process), and clients
+    already built are dropped so they are rebuilt with the new size.
+    """
+    global _max_pool_connections
+    if os.environ.get('AWS_MAX_POOL_CONNECTIONS'):
+        return
+    with _clients_lock:
+        if max_pool_connections > _max_pool_connections:
+            _max_pool_connections = max_pool_connections
+            _clients.clear()
+
+def client_config(service):
+    """The botocore Config every client of a service is built with"""
+    return Config(
+        max_pool_connections=_max_pool_connections,
+        connect_timeout=AWS_CONNECT_TIMEOUT,
+        read_timeout=S3_READ_TIMEOUT if service == 's3' else AWS_READ_TIMEOUT,
+        retries={'mode': AWS_RETRY_MODE, 'total_max_attempts': AWS_MAX_ATTEMPTS},
+        tcp_keepalive=True
+    )
+
+def get_client(service):
+    """Return the memoized boto3 client for a service, building it on first use"""
+    client = _clients.get(service)
+    if client is None:
+        # boto3's default session is not thread-safe for client creation
+        with _clients_lock:
+            client = _clients.get(service)
+            if client is None:
+                with timed_init(f"{service}_client"):
+                    client = boto3.client(service, config=client_config(service))
+                _clients[service] = client
+    return client
+
+def reset_clients():
+    """Drop memoized clients (local runs and benchmarks that swap AWS endpoints)"""
+    with _clients_lock:
+        _clients.clear()
+        init_timings.clear()
+
+def startup_report(module_import_ms):
+    """Summarize cold-start cost: module import time plus lazy initializations so far"""
+    return {
+        "module_import_ms": module_import_ms,
+        "lazy_init_ms": dict(init_timings)
+    }
+
+def photo_partition_key(store_id, file_key=None):
+    """Partition for a store's photo record: "{store}#PHOTO", or "{store}#PHOTO#{shard}" when sharded.
+
+    The shard is a CRC32 of the file key, which is stable across processes, so
+    every Lambda derives the same one. Records without a known file key stay in
+    the unsharded partition.
+    """
+    if PHOTO_SHARDS <= 1 or not file_key:
+        return f"{store_id}#PHOTO"
+    return f"{store_id}#PHOTO#{zlib.crc32(file_key.encode()) % PHOTO_SHARDS}"
+
+def photo_partition_keys(store_id):
+    """Every partition a store's photo records can be in, for scatter-gather reads"""
+    keys = [f"{store_id}#PHOTO"]
+    if PHOTO_SHARDS > 1:
+        # The unsharded partition still holds records written before sharding was enabled
+        keys.extend(f"{store_id}#PHOTO#{shard}" for shard in range(PHOTO_SHARDS))
+    return keys
+
+def photo_sort_key(status, uploaded_at, file_name):
+    """Sort key of a photo record; the upload Lambda rebuilds it from the SQS message's uploadedAt"""
+    return f"{status}#{uploaded_at}#{file_name}"
+
+def content_index_key(content_hash, store_id):
+    """Key of the content index entry claimed at ingest and released when an upload fails"""
+    return {'PK': {'S': f"{content_hash}#CONTENT"}, 'SK': {'S': store_id}}
+
+def generate_file_key(store_id, file_name, folder=UPLOADS_FOLDER):
+    """S3 key for a new upload, unique even when the same file name is uploaded again"""
+    return f"{folder}/{store_id}/{uuid.uuid4()}-{file_name}"
+
+def parse_file_key(file_key, folder):
+    """(store_id, file_name) for a key generate_file_key built under folder; None for any other key"""
+    prefix = f"{folder}/"
+    if not file_key.startswith(prefix):
+        return None
+    store_id, _, name = file_key[len(prefix):].partition('/')
+    if not store_id or '/' in name or len(name) <= OBJECT_ID_LENGTH:
+        return None
+    return store_id, name[OBJECT_ID_LENGTH:]
+
+def is_transient_error(error):
+    """Transaction conflicts, the transient DynamoDB failure botocore does not retry itself"""
+    if not isinstance(error, ClientError):
+        return False
+    code = error.response['Error']['Code']
+    if code == 'TransactionCanceledException':
+        # Cancelled by a concurrent transaction rather than by one of its own conditions
+        reasons = [reason.get('Code') for reason in error.response.get('CancellationReasons', [])]
+        return 'TransactionConflict' in reasons and 'ConditionalCheckFailed' not in reasons
+    return code in TRANSIENT_ERROR_CODES
+
+def retry(func=None, *, only=None):
+    """Retry with exponential backoff; only, when given, limits retries to errors it accepts"""
+    if func is None:
+        return lambda f: retry(f, only=only)
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        retries = 0
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                if only is not None and not only(e):
+                    raise
+                retries += 1
+                if retries == MAX_RETRIES:
+                    raise
+                log_with_context(f"Error in {func.__name__}, retrying {retries}/{MAX_RETRIES}",
+                                 level="warning", error=e)
+                count('Retries')
+                time.sleep(RETRY_DELAY * 2 ** (retries - 1))
+    return wrapper
+
+def retry_with_backoff(func, *args, **kwargs):
+    """Call func now, retrying transaction conflicts on top of the client's own retries"""
+    return retry(func, only=is_transient_error)(*args, **kwargs)
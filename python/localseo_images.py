@@ -0,0 +1,205 @@
+'''
+Image checks for the local SEO photo Lambdas, applied at ingest so photos Google
+Business Profile would reject never reach S3, DynamoDB, SQS or the GBP API.
+
+Validation only reads the file header: the type comes from the magic bytes and
+the dimensions from the JPEG SOF segment or PNG IHDR chunk, so nothing is decoded.
+
+Environment variables:
+RECOMPRESS_OVERSIZED  Set to "true" to downscale and re-encode photos above
+                      MAX_IMAGE_SIZE instead of rejecting them (default false)
+THUMBNAILS_ENABLED    Set to "false" to skip WebP thumbnail generation (default true)
+
+Recompression and thumbnails need Pillow, which is not part of the Lambda runtime;
+add it to the function's layer before enabling RECOMPRESS_OVERSIZED (thumbnails
+are skipped without it). Both run in a process pool where the platform supports
+one and fall back to threads on AWS Lambda, which has no /dev/shm for
+multiprocessing (Pillow releases the GIL while resampling and encoding, so
+threads still spread a batch across cores).
+'''
+import importlib.util
+import os
+import struct
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from io import BytesIO
+
+# GBP photo requirements
+MAX_IMAGE_SIZE = 5 * 1024 * 1024  # 5MB
+MIN_IMAGE_SIZE = 10 * 1024  # 10KB
+MIN_IMAGE_DIMENSION = 250  # Pixels, both sides
+VALID_CONTENT_TYPES = ['image/jpeg', 'image/png']
+
+HEADER_BYTES = 256 * 1024  # Enough to reach the JPEG SOF segment past large EXIF/ICC blocks
+RECOMPRESS_OVERSIZED = os.environ.get('RECOMPRESS_OVERSIZED', 'false').lower() == 'true'
+RECOMPRESS_MAX_DIMENSION = 3000  # Longest side after downscaling, in pixels
+RECOMPRESS_QUALITIES = (85, 75, 65)  # JPEG qualities tried before shrinking further
+RECOMPRESS_WORKERS = max(1, os.cpu_count() or 1)
+THUMBNAILS_ENABLED = os.environ.get('THUMBNAILS_ENABLED', 'true').lower() != 'false'
+THUMBNAIL_PATH = "local-seo-photos/thumbnails"
+THUMBNAIL_SIZES = (200, 600)  # Longest side of each thumbnail, in pixels
+THUMBNAIL_QUALITY = 80  # WebP quality
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+JPEG_SIGNATURE = b'\xff\xd8\xff'
+# Start-of-frame markers carry the dimensions; C4, C8 and CC are not frames
+JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+class InvalidImageError(ValueError):
+    """The photo can never be accepted by GBP; the caller should answer 400, not retry"""
+
+def sniff_content_type(header):
+    """Content type from the magic bytes, or None for anything that is not JPEG or PNG"""
+    if header.startswith(JPEG_SIGNATURE):
+        return 'image/jpeg'
+    if header.startswith(PNG_SIGNATURE):
+        return 'image/png'
+    return None
+
+def _jpeg_dimensions(header):
+    offset = 2
+    while offset + 4 <= len(header):
+        if header[offset] != 0xFF:
+            raise InvalidImageError("Corrupt JPEG header")
+        marker = header[offset + 1]
+        if marker == 0xFF:
+            # Fill byte before a marker
+            offset += 1
+            continue
+        if marker == 0xD8 or 0xD0 <= marker <= 0xD7 or marker == 0x01:
+            offset += 2
+            continue
+        if marker in (0xD9, 0xDA):
+            # End of image or start of scan before any frame header
+            raise InvalidImageError("JPEG has no frame header")
+        length = struct.unpack('>H', header[offset + 2:offset + 4])[0]
+        if marker in JPEG_SOF_MARKERS:
+            if offset + 9 > len(header):
+                return None
+            height, width = struct.unpack('>HH', header[offset + 5:offset + 9])
+            return width, height
+        offset += 2 + length
+    return None
+
+def image_dimensions(header, content_type):
+    """(width, height) from the header, or None when the header is cut off before them"""
+    if content_type == 'image/png':
+        if len(header) < 24 or header[12:16] != b'IHDR':
+            raise InvalidImageError("Corrupt PNG header")
+        return struct.unpack('>II', header[16:24])
+    return _jpeg_dimensions(header)
+
+def inspect_image(header, file_size, declared_type=None, complete=False):
+    """Check a photo against the GBP rules using only its header.
+
+    header is the start of the file (HEADER_BYTES is plenty) or the whole file
+    when complete=True. Returns {'content_type', 'width', 'height', 'oversized'};
+    a photo above MAX_IMAGE_SIZE is reported as oversized rather than rejected
+    when RECOMPRESS_OVERSIZED is on. Raises InvalidImageError otherwise.
+    """
+    content_type = sniff_content_type(header)
+    if content_type is None:
+        raise InvalidImageError("File is not a JPEG or PNG image")
+    if declared_type and declared_type != content_type:
+        raise InvalidImageError(f"Content type {declared_type} does not match file contents ({content_type})")
+    if file_size < MIN_IMAGE_SIZE:
+        raise InvalidImageError(f"File too small: {file_size} bytes (min {MIN_IMAGE_SIZE} bytes)")
+
+    dimensions = image_dimensions(header, content_type)
+    if dimensions is None and complete:
+        raise InvalidImageError("Could not read image dimensions")
+    width, height = dimensions or (None, None)
+    if dimensions and min(dimensions) < MIN_IMAGE_DIMENSION:
+        raise InvalidImageError(
+            f"Image too small: {width}x{height} (min {MIN_IMAGE_DIMENSION}x{MIN_IMAGE_DIMENSION} pixels)"
+        )
+
+    oversized = file_size > MAX_IMAGE_SIZE
+    if oversized and not RECOMPRESS_OVERSIZED:
+        raise InvalidImageError(f"File too large: {file_size} bytes (max {MAX_IMAGE_SIZE} bytes)")
+    return {
+        'content_type': content_type,
+        'width': width,
+        'height': height,
+        'oversized': oversized
+    }
+
+def recompress_image(data):
+    """Downscale and re-encode a photo as JPEG until it fits MAX_IMAGE_SIZE; returns the new bytes.
+
+    Runs in a worker process, so it takes and returns plain bytes.
+    """
+    try:
+        from PIL import Image, ImageOps
+    except ImportError:
+        raise InvalidImageError(
+            f"File too large: {len(data)} bytes (max {MAX_IMAGE_SIZE} bytes) and Pillow is not installed"
+        )
+
+    image = ImageOps.exif_transpose(Image.open(BytesIO(data)))
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    limit = RECOMPRESS_MAX_DIMENSION
+    while limit >= MIN_IMAGE_DIMENSION:
+        image.thumbnail((limit, limit))
+        for quality in RECOMPRESS_QUALITIES:
+            buffer = BytesIO()
+            image.save(buffer, format='JPEG', quality=quality, optimize=True)
+            if buffer.tell() <= MAX_IMAGE_SIZE:
+                return buffer.getvalue()
+        limit = int(limit * 0.75)
+    raise InvalidImageError("Photo could not be recompressed below the GBP size limit")
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                try:
+                    pool = ProcessPoolExecutor(max_workers=RECOMPRESS_WORKERS)
+                    # Fails here rather than on submit where semaphores are unavailable
+                    pool.submit(int).result()
+                except (OSError, NotImplementedError):
+                    pool = ThreadPoolExecutor(max_workers=RECOMPRESS_WORKERS, thread_name_prefix="images")
+                _pool = pool
+    return _pool
+
+def submit_recompress(data):
+    """Queue recompress_image on the CPU pool and return its future"""
+    return _get_pool().submit(recompress_image, data)
+
+def make_thumbnails(data):
+    """Render each THUMBNAIL_SIZES thumbnail as WebP; returns {size: bytes}.
+
+    Runs in a worker process, so it takes and returns plain bytes.
+    """
+    from PIL import Image, ImageOps
+
+    image = ImageOps.exif_transpose(Image.open(BytesIO(data)))
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGB')
+    thumbnails = {}
+    # Largest first, so each smaller size is resampled from the previous one
+    for size in sorted(THUMBNAIL_SIZES, reverse=True):
+        image.thumbnail((size, size))
+        buffer = BytesIO()
+        image.save(buffer, format='WEBP', quality=THUMBNAIL_QUALITY)
+        thumbnails[size] = buffer.getvalue()
+    return thumbnails
+
+def thumbnail_key(content_hash, size):
+    """S3 key of a thumbnail; content-addressed, so every store's copy of a photo shares it"""
+    return f"{THUMBNAIL_PATH}/{content_hash}/{size}.webp"
+
+def thumbnails_available():
+    """Whether thumbnails are enabled and Pillow is installed"""
+    return THUMBNAILS_ENABLED and importlib.util.find_spec('PIL') is not None
+
+def submit_thumbnails(data):
+    """Queue make_thumbnails on the CPU pool; None when thumbnails are unavailable"""
+    if not thumbnails_available():
+        return None
+    return _get_pool().submit(make_thumbnails, data)
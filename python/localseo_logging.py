@@ -0,0 +1,81 @@
+'''
+Structured JSON logging shared by the local SEO photo Lambdas.
+
+Environment variables:
+LOG_LEVEL             Minimum level emitted: DEBUG, INFO, WARNING or ERROR (default INFO)
+LOG_SAMPLE_RATE       Fraction of sampled success-path logs that are emitted (default 0.1)
+LOG_MAX_FIELD_LENGTH  Strings longer than this are truncated (default 1024)
+'''
+import json
+import logging
+import os
+import random
+import time
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_SAMPLE_RATE = float(os.environ.get('LOG_SAMPLE_RATE', '0.1'))
+LOG_MAX_FIELD_LENGTH = int(os.environ.get('LOG_MAX_FIELD_LENGTH', '1024'))
+LOG_MAX_LIST_ITEMS = 20
+
+# Fields never worth logging: request payloads that can be megabytes of base64
+REDACTED_FIELDS = {'fileContent'}
+
+LEVELS = {
+    "debug": logging.DEBUG,
+    "info": logging.INFO,
+    "warning": logging.WARNING,
+    "error": logging.ERROR
+}
+
+# A named logger keeps LOG_LEVEL=DEBUG from also enabling botocore's debug output;
+# records still propagate to the handler the Lambda runtime installs on the root logger
+logger = logging.getLogger("localseo")
+logger.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+
+def sanitize(value):
+    """Redact payload fields and truncate large values so log lines stay small"""
+    if isinstance(value, dict):
+        return {
+            key: "[REDACTED]" if key in REDACTED_FIELDS else sanitize(item)
+            for key, item in value.items()
+        }
+    if isinstance(value, (list, tuple)):
+        items = [sanitize(item) for item in value[:LOG_MAX_LIST_ITEMS]]
+        if len(value) > LOG_MAX_LIST_ITEMS:
+            items.append(f"...[{len(value) - LOG_MAX_LIST_ITEMS} more items]")
+        return items
+    if isinstance(value, (bytes, bytearray)):
+        return f"<{len(value)} bytes>"
+    if isinstance(value, str) and len(value) > LOG_MAX_FIELD_LENGTH:
+        return f"{value[:LOG_MAX_FIELD_LENGTH]}...[truncated {len(value) - LOG_MAX_FIELD_LENGTH} chars]"
+    return value
+
+def log_with_context(message, context=None, level="info", error=None, request_id=None, sample=False):
+    """Emit a structured log line; nothing is serialized unless the level is enabled.
+
+    context may be a dict or a zero-argument callable returning one, so expensive
+    context is only built for lines that are actually written. sample=True marks
+    high-volume success-path lines that are emitted at LOG_SAMPLE_RATE.
+    """
+    levelno = LEVELS.get(level, logging.INFO)
+    if not logger.isEnabledFor(levelno):
+        return
+    if sample and random.random() >= LOG_SAMPLE_RATE:
+        return
+
+    if callable(context):
+        context = context()
+
+    log_data = {
+        "message": message,
+        "timestamp": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "level": level,
+        "context": sanitize(context or {}),
+        "error": {
+            "message": str(error) if error else None,
+            "type": error.__class__.__name__ if error else None
+        },
+        "request_id": request_id
+    }
+
+    logger.log(levelno, json.dumps(log_data, default=str))
@@ -0,0 +1,125 @@
+'''
+Per-stage latency metrics for the local SEO photo Lambdas, emitted as
+CloudWatch Embedded Metric Format (EMF) log lines.
+
+Environment variables:
+METRICS_NAMESPACE  CloudWatch namespace for the metrics (default LocalSEO/Photos)
+METRICS_ENABLED    Set to "false" to stop emitting EMF documents (default true)
+
+EMF documents are printed to stdout, which CloudWatch Logs turns into metrics in
+Lambda. Run locally, the same documents are printed so they can be inspected, and
+MetricsRecorder.snapshot() returns them without printing.
+'''
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'LocalSEO/Photos')
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() != 'false'
+
+_current = threading.local()
+
+class MetricsRecorder:
+    """Collect stage timings and counts for one unit of work and flush them as one EMF document.
+
+    Used as a context manager, the recorder becomes the current recorder for the
+    calling thread so module-level timer() and count() calls are attributed to it,
+    and it is flushed on exit.
+    """
+
+    def __init__(self, service, dimensions=None):
+        self.service = service
+        self.dimensions = dict(dimensions or {})
+        self._timings = {}
+        self._counts = {}
+        self._previous = None
+
+    def set_dimension(self, name, value):
+        self.dimensions[name] = str(value)
+
+    def add_timing(self, stage, milliseconds):
+        self._timings.setdefault(f"{stage}Latency", []).append(round(milliseconds, 3))
+
+    def add_count(self, name, value=1):
+        self._counts[name] = self._counts.get(name, 0) + value
+
+    @contextmanager
+    def timer(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_timing(stage, (time.perf_counter() - start) * 1000)
+
+    def snapshot(self):
+        """Return the EMF document for everything recorded so far"""
+        dimensions = {"Service": self.service, **self.dimensions}
+        metrics = [{"Name": name, "Unit": "Milliseconds"} for name in self._timings]
+        metrics += [{"Name": name, "Unit": "Count"} for name in self._counts]
+        return {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [list(dimensions)],
+                    "Metrics": metrics
+                }]
+            },
+            **dimensions,
+            **{name: values if len(values) > 1 else values[0] for name, values in self._timings.items()},
+            **self._counts
+        }
+
+    def flush(self):
+        if METRICS_ENABLED and (self._timings or self._counts):
+            print(json.dumps(self.snapshot()))
+        self._timings = {}
+        self._counts = {}
+
+    def __enter__(self):
+        self._previous = getattr(_current, 'recorder', None)
+        _current.recorder = self
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        _current.recorder = self._previous
+        self.flush()
+        return False
+
+def current_metrics():
+    """Return the recorder bound to the calling thread, if any"""
+    return getattr(_current, 'recorder', None)
+
+@contextmanager
+def bind(recorder):
+    """Attribute the calling thread's metrics to recorder, e.g. inside a worker pool"""
+    previous = getattr(_current, 'recorder', None)
+    _current.recorder = recorder
+    try:
+        yield recorder
+    finally:
+        _current.recorder = previous
+
+@contextmanager
+def timer(stage):
+    """Time a stage against the current recorder; a no-op when none is bound"""
+    recorder = current_metrics()
+    if recorder is None:
+        yield
+        return
+    with recorder.timer(stage):
+        yield
+
+def count(name, value=1):
+    """Add to a counter on the current recorder; a no-op when none is bound"""
+    recorder = current_metrics()
+    if recorder is not None:
+        recorder.add_count(name, value)
+
+def set_dimension(name, value):
+    """Set a dimension on the current recorder; a no-op when none is bound"""
+    recorder = current_metrics()
+    if recorder is not None:
+        recorder.set_dimension(name, value)
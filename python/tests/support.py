@@ -0,0 +1,55 @@
+'''
+Helpers for the unit tests, which cover the pure functions of the Lambdas and
+shared modules without any AWS calls (boto3 must be installed, moto is not needed).
+
+Run from the python directory:
+python -m unittest discover tests
+'''
+import importlib.util
+import os
+import struct
+import sys
+
+PYTHON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PYTHON_DIR)
+# Keep EMF documents out of the test output
+os.environ.setdefault('METRICS_ENABLED', 'false')
+
+_lambdas = {}
+
+def load_lambda(name):
+    """Import a Lambda handler module by its file name (hyphens and all), once per test run"""
+    if name not in _lambdas:
+        spec = importlib.util.spec_from_file_location(name.replace('-', '_'), os.path.join(PYTHON_DIR, f"{name}.py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        _lambdas[name] = module
+    return _lambdas[name]
+
+def jpeg_header(width, height, segments=b''):
+    """Start of a baseline JPEG: SOI, the given segments, then a SOF0 frame header"""
+    sof = b'\xff\xc0' + struct.pack('>HBHHB', 11, 8, height, width, 1) + b'\x01\x11\x00'
+    return b'\xff\xd8' + segments + sof
+
+def jpeg_segment(marker, payload):
+    return bytes([0xFF, marker]) + struct.pack('>H', len(payload) + 2) + payload
+
+def png_header(width, height):
+    return b'\x89PNG\r\n\x1a\n' + struct.pack('>I', 13) + b'IHDR' + struct.pack('>II', width, height) + b'\x08\x02\x00\x00\x00'
+
+class FakeClock:
+    """Stands in for the time module: sleep advances monotonic instead of blocking.
+
+    Tests use rates whose waits are exact binary fractions, so the clock always lands on them.
+    """
+
+    def __init__(self):
+        self.now = 1000.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
@@ -0,0 +1,31 @@
+import unittest
+
+import support  # Must come first: puts the python directory on sys.path and turns metrics off
+
+from localseo_aws import DIRECT_UPLOADS_FOLDER, ERRORS_FOLDER, UPLOADS_FOLDER, generate_file_key, parse_file_key
+
+class FileKeyTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        key = generate_file_key('store-1', 'front-door.jpg')
+        self.assertTrue(key.startswith(f"{UPLOADS_FOLDER}/store-1/"))
+        self.assertEqual(parse_file_key(key, UPLOADS_FOLDER), ('store-1', 'front-door.jpg'))
+
+    def test_round_trip_in_direct_folder(self):
+        key = generate_file_key('store-1', 'front-door.jpg', DIRECT_UPLOADS_FOLDER)
+        self.assertEqual(parse_file_key(key, DIRECT_UPLOADS_FOLDER), ('store-1', 'front-door.jpg'))
+
+    def test_nested_folder_is_not_a_store(self):
+        key = generate_file_key('store-1', 'front-door.jpg', DIRECT_UPLOADS_FOLDER)
+        self.assertIsNone(parse_file_key(key, UPLOADS_FOLDER))
+
+    def test_other_folder(self):
+        key = generate_file_key('store-1', 'front-door.jpg', ERRORS_FOLDER)
+        self.assertIsNone(parse_file_key(key, UPLOADS_FOLDER))
+
+    def test_name_without_object_id(self):
+        self.assertIsNone(parse_file_key(f"{UPLOADS_FOLDER}/store-1/front-door.jpg", UPLOADS_FOLDER))
+        self.assertIsNone(parse_file_key(f"{UPLOADS_FOLDER}//{'0' * 40}.jpg", UPLOADS_FOLDER))
+
+if __name__ == '__main__':
+    unittest.main()
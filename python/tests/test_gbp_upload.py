@@ -0,0 +1,64 @@
+import unittest
+from unittest import mock
+
+from botocore.exceptions import ReadTimeoutError
+
+from support import load_lambda
+
+upload = load_lambda('local-seo-google-business-upload-corrected')
+
+def record(message_id, body='{}'):
+    return {'messageId': message_id, 'body': body, 'attributes': {'ApproximateReceiveCount': '1'}}
+
+class BatchResponseTest(unittest.TestCase):
+
+    def test_malformed_message_is_acknowledged(self):
+        results, failed = upload.process_records([record('m1', 'not json')], 'request')
+        self.assertEqual(results, [])
+        self.assertEqual(failed[0]['errorType'], 'JSONDecodeError')
+        self.assertEqual(upload.build_batch_response(failed), {'batchItemFailures': []})
+
+    def test_only_resumable_failures_are_returned_to_the_queue(self):
+        def process_message(message, request_id, move_stage):
+            if message['messageId'] == 'failed':
+                raise upload.PhotoFailedError(ValueError("GBP rejected the photo"))
+            if message['messageId'] == 'resumable':
+                raise RuntimeError("DynamoDB write failed after the GBP upload")
+            return {'success': True}
+
+        records = [record('ok'), record('failed'), record('resumable')]
+        with mock.patch.object(upload, 'process_message', process_message):
+            results, failed = upload.process_records(records, 'request', max_concurrency=1)
+        self.assertEqual(results, [{'success': True}])
+        self.assertEqual([failure['errorType'] for failure in failed], ['ValueError', 'RuntimeError'])
+        self.assertEqual(upload.build_batch_response(failed), {'batchItemFailures': [{'itemIdentifier': 'resumable'}]})
+
+class UnreachableTable:
+    """DynamoDB client whose every call times out"""
+
+    def __getattr__(self, name):
+        def call(**kwargs):
+            raise ReadTimeoutError(endpoint_url='https://dynamodb.us-east-1.amazonaws.com')
+        return call
+
+class CircuitBreakerTimeoutTest(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(upload, 'get_client', lambda name: UnreachableTable())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = upload.CircuitBreaker()
+
+    def test_unreadable_state_never_blocks_uploads(self):
+        self.assertEqual(self.breaker.state()['state'], 'closed')
+        self.assertFalse(self.breaker.is_open())
+        self.assertFalse(self.breaker.before_call())
+
+    def test_bookkeeping_timeouts_are_not_raised(self):
+        self.breaker._state['failures'] = 1
+        self.breaker._loaded_at = float('inf')
+        self.breaker.record_success(probe=False)
+        self.breaker.record_failure(probe=True)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+
+from support import jpeg_header, jpeg_segment, png_header
+
+import localseo_images
+from localseo_images import InvalidImageError, image_dimensions, inspect_image, sniff_content_type
+
+class ImageDimensionsTest(unittest.TestCase):
+
+    def test_png_dimensions_from_ihdr(self):
+        self.assertEqual(image_dimensions(png_header(800, 600), 'image/png'), (800, 600))
+
+    def test_corrupt_png_header(self):
+        with self.assertRaises(InvalidImageError):
+            image_dimensions(png_header(800, 600)[:20], 'image/png')
+
+    def test_jpeg_dimensions_from_sof(self):
+        self.assertEqual(image_dimensions(jpeg_header(1024, 768), 'image/jpeg'), (1024, 768))
+
+    def test_jpeg_sof_after_app_segments_and_fill_bytes(self):
+        segments = jpeg_segment(0xE0, b'JFIF\x00' + b'\x00' * 9) + jpeg_segment(0xE1, b'Exif' + b'\x00' * 500) + b'\xff'
+        self.assertEqual(image_dimensions(jpeg_header(4000, 3000, segments), 'image/jpeg'), (4000, 3000))
+
+    def test_progressive_jpeg(self):
+        header = jpeg_header(640, 480).replace(b'\xff\xc0', b'\xff\xc2', 1)
+        self.assertEqual(image_dimensions(header, 'image/jpeg'), (640, 480))
+
+    def test_jpeg_header_cut_off_before_frame(self):
+        segments = jpeg_segment(0xE1, b'\x00' * 1000)
+        self.assertIsNone(image_dimensions(jpeg_header(640, 480, segments)[:200], 'image/jpeg'))
+
+    def test_jpeg_scan_before_frame(self):
+        with self.assertRaises(InvalidImageError):
+            image_dimensions(b'\xff\xd8' + jpeg_segment(0xDA, b'\x00' * 4), 'image/jpeg')
+
+    def test_jpeg_without_marker(self):
+        with self.assertRaises(InvalidImageError):
+            image_dimensions(b'\xff\xd8\x00\x00\x00\x00', 'image/jpeg')
+
+class InspectImageTest(unittest.TestCase):
+
+    def test_content_type_from_magic_bytes(self):
+        self.assertEqual(sniff_content_type(jpeg_header(10, 10)), 'image/jpeg')
+        self.assertEqual(sniff_content_type(png_header(10, 10)), 'image/png')
+        self.assertIsNone(sniff_content_type(b'GIF89a'))
+
+    def test_accepts_valid_photo(self):
+        image = inspect_image(jpeg_header(1024, 768), 200_000, 'image/jpeg')
+        self.assertEqual(image, {'content_type': 'image/jpeg', 'width': 1024, 'height': 768, 'oversized': False})
+
+    def test_rejects_declared_type_mismatch(self):
+        with self.assertRaises(InvalidImageError):
+            inspect_image(png_header(800, 600), 200_000, 'image/jpeg')
+
+    def test_rejects_small_file_and_small_dimensions(self):
+        with self.assertRaises(InvalidImageError):
+            inspect_image(jpeg_header(1024, 768), localseo_images.MIN_IMAGE_SIZE - 1)
+        with self.assertRaises(InvalidImageError):
+            inspect_image(jpeg_header(1024, 200), 200_000)
+
+    def test_missing_dimensions_only_fail_a_complete_file(self):
+        header = jpeg_header(1024, 768)[:4]
+        self.assertIsNone(inspect_image(header, 200_000)['width'])
+        with self.assertRaises(InvalidImageError):
+            inspect_image(header, 200_000, complete=True)
+
+    def test_oversized_rejected_unless_recompressing(self):
+        size = localseo_images.MAX_IMAGE_SIZE + 1
+        with self.assertRaises(InvalidImageError):
+            inspect_image(jpeg_header(1024, 768), size)
+        original = localseo_images.RECOMPRESS_OVERSIZED
+        localseo_images.RECOMPRESS_OVERSIZED = True
+        try:
+            self.assertTrue(inspect_image(jpeg_header(1024, 768), size)['oversized'])
+        finally:
+            localseo_images.RECOMPRESS_OVERSIZED = original
+
+if __name__ == '__main__':
+    unittest.main()
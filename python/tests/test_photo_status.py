@@ -0,0 +1,136 @@
+import unittest
+
+from support import load_lambda
+
+import localseo_aws
+
+status = load_lambda('local-seo-photo-status')
+
+class FakeTable:
+    """query_status over in-memory records, with DynamoDB's newest-first Limit/ExclusiveStartKey semantics"""
+
+    def __init__(self):
+        self.items = []
+        self.queries = 0
+
+    def add(self, store_id, state, uploaded_at, file_name):
+        file_key = f"local-seo-photos/uploads/{store_id}/{file_name}"
+        self.items.append({
+            'PK': {'S': localseo_aws.photo_partition_key(store_id, file_key)},
+            'SK': {'S': f"{state}#{uploaded_at}#{file_name}"},
+            'fileName': {'S': file_name},
+            'status': {'S': state}
+        })
+
+    def query_status(self, partition_key, state, since, until, limit, after_sk=None):
+        self.queries += 1
+        matching = sorted(
+            (item for item in self.items
+             if item['PK']['S'] == partition_key and item['SK']['S'].startswith(f"{state}#")
+             and (after_sk is None or item['SK']['S'] < after_sk)),
+            key=lambda item: item['SK']['S'], reverse=True
+        )
+        return matching[:limit], len(matching) > limit
+
+class ListPhotosTest(unittest.TestCase):
+
+    def setUp(self):
+        self.shards = localseo_aws.PHOTO_SHARDS
+        self.table = FakeTable()
+        self.query_status = status.query_status
+        status.query_status = self.table.query_status
+
+    def tearDown(self):
+        localseo_aws.PHOTO_SHARDS = self.shards
+        status.query_status = self.query_status
+
+    def populate(self, count):
+        states = status.STATUSES
+        for index in range(count):
+            self.table.add('dc', states[index % len(states)], f"2026-10-18T04:{index:02d}:00", f"photo-{index}.jpg")
+        # Another store's records never appear
+        self.table.add('towson', 'PENDING', "2026-10-18T05:00:00", "other.jpg")
+
+    def pages(self, limit, statuses=status.STATUSES):
+        photos, cursor = [], None
+        while True:
+            page = status.list_photos('dc', statuses, limit=limit, cursor=cursor)
+            self.assertLessEqual(len(page['photos']), limit)
+            photos.extend(page['photos'])
+            cursor = page['nextCursor']
+            if cursor is None:
+                return photos
+
+    def assert_newest_first(self, photos, count, statuses=status.STATUSES):
+        expected = [
+            f"photo-{index}.jpg" for index in reversed(range(count))
+            if status.STATUSES[index % len(status.STATUSES)] in statuses
+        ]
+        self.assertEqual([photo['fileName'] for photo in photos], expected)
+
+    def test_merges_statuses_newest_first_across_pages(self):
+        self.populate(23)
+        self.assert_newest_first(self.pages(limit=5), 23)
+
+    def test_merges_across_shards(self):
+        localseo_aws.PHOTO_SHARDS = 4
+        self.populate(40)
+        # The unsharded partition can still hold records written before sharding
+        self.table.add('dc', 'FAILED', "2026-10-18T03:59:00", "legacy.jpg")
+        photos = self.pages(limit=7)
+        self.assert_newest_first(photos[:-1], 40)
+        self.assertEqual(photos[-1]['fileName'], "legacy.jpg")
+
+    def test_status_filter(self):
+        localseo_aws.PHOTO_SHARDS = 3
+        self.populate(20)
+        self.assert_newest_first(self.pages(limit=4, statuses=('COMPLETED',)), 20, ('COMPLETED',))
+
+    def test_last_page_has_no_cursor(self):
+        self.populate(3)
+        page = status.list_photos('dc', status.STATUSES, limit=3)
+        self.assertEqual(len(page['photos']), 3)
+        self.assertIsNone(page['nextCursor'])
+
+    def test_exhausted_streams_are_not_queried_again(self):
+        self.table.add('dc', 'FAILED', "2026-10-18T05:00:00", "failed.jpg")
+        for index in range(6):
+            self.table.add('dc', 'PENDING', f"2026-10-18T04:{index:02d}:00", f"pending-{index}.jpg")
+        page = status.list_photos('dc', status.STATUSES, limit=3)
+        positions = status.decode_cursor(page['nextCursor'])
+        self.assertEqual(positions, {
+            "PENDING@dc#PHOTO": "PENDING#2026-10-18T04:04:00#pending-4.jpg",
+            "COMPLETED@dc#PHOTO": None,
+            "FAILED@dc#PHOTO": None
+        })
+        queries = self.table.queries
+        page = status.list_photos('dc', status.STATUSES, limit=3, cursor=page['nextCursor'])
+        self.assertEqual(self.table.queries - queries, 1)
+        self.assertEqual([photo['fileName'] for photo in page['photos']], [f"pending-{index}.jpg" for index in (3, 2, 1)])
+
+    def test_cursor_for_another_store_is_rejected(self):
+        self.populate(9)
+        cursor = status.encode_cursor({status.stream_id('PENDING', 'towson#PHOTO'): ""})
+        with self.assertRaises(status.BadRequest):
+            status.list_photos('dc', status.STATUSES, cursor=cursor)
+
+class CursorTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        positions = {"PENDING@dc#PHOTO": "PENDING#2026-10-18T04:00:00#a.jpg", "FAILED@dc#PHOTO": None}
+        self.assertEqual(status.decode_cursor(status.encode_cursor(positions)), positions)
+
+    def test_invalid_cursors(self):
+        for cursor in ("not base64!", status.encode_cursor(["a"]), status.encode_cursor({"PENDING@dc#PHOTO": 3}),
+                       status.encode_cursor({"PENDING@dc#PHOTO": {"S": "x"}})):
+            with self.subTest(cursor=cursor), self.assertRaises(status.BadRequest):
+                status.decode_cursor(cursor)
+
+    def test_invalid_cursor_is_a_400(self):
+        response = status.lambda_handler({"queryStringParameters": {
+            "storeId": "dc", "cursor": status.encode_cursor({"PENDING@dc#PHOTO": 3})
+        }}, None)
+        self.assertEqual(response['statusCode'], 400)
+
+if __name__ == '__main__':
+    unittest.main()
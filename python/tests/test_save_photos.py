@@ -0,0 +1,24 @@
+import base64
+import unittest
+
+from support import jpeg_header, load_lambda
+
+save = load_lambda('local-seo-save-photos-to-s3')
+
+class DecodedLengthTest(unittest.TestCase):
+
+    def test_matches_decoded_size_for_every_padding(self):
+        for size in range(0, 12):
+            data = bytes(range(size))
+            with self.subTest(size=size):
+                self.assertEqual(save.decoded_length(base64.b64encode(data).decode()), size)
+
+class ValidatePhotoTest(unittest.TestCase):
+
+    def test_reads_dimensions_from_the_header_of_a_large_photo(self):
+        photo = jpeg_header(1200, 900) + b'\x00' * 400_000
+        image = save.validate_photo(base64.b64encode(photo).decode(), 'image/jpeg')
+        self.assertEqual((image['width'], image['height']), (1200, 900))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,54 @@
+import unittest
+
+from support import FakeClock, load_lambda
+
+upload = load_lambda('local-seo-google-business-upload-corrected')
+
+class TokenBucketTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.time = upload.time
+        upload.time = self.clock
+
+    def tearDown(self):
+        upload.time = self.time
+
+    def test_burst_then_rate(self):
+        bucket = upload.TokenBucket(rate=2, capacity=3)
+        for _ in range(3):
+            bucket.acquire()
+        self.assertEqual(self.clock.slept, [])
+        bucket.acquire()
+        self.assertAlmostEqual(sum(self.clock.slept), 0.5)
+
+    def test_refill_is_capped_at_capacity(self):
+        bucket = upload.TokenBucket(rate=4, capacity=2)
+        self.clock.now += 60
+        for _ in range(3):
+            bucket.acquire()
+        self.assertAlmostEqual(sum(self.clock.slept), 0.25)
+
+    def test_block_for_holds_every_caller(self):
+        bucket = upload.TokenBucket(rate=5, capacity=5)
+        bucket.block_for(4)
+        bucket.acquire()
+        self.assertAlmostEqual(sum(self.clock.slept), 4)
+
+    def test_decrease_halves_rate_and_drops_tokens(self):
+        bucket = upload.TokenBucket(rate=4, capacity=4)
+        bucket.decrease()
+        self.assertEqual(bucket.rate, 2)
+        bucket.acquire()
+        self.assertAlmostEqual(sum(self.clock.slept), 0.5)
+
+    def test_rate_stays_between_floor_and_limit(self):
+        bucket = upload.TokenBucket(rate=upload.GBP_MIN_RATE, capacity=1)
+        bucket.decrease()
+        self.assertEqual(bucket.rate, upload.GBP_MIN_RATE)
+        for _ in range(1000):
+            bucket.increase()
+        self.assertEqual(bucket.rate, upload.GBP_RATE_LIMIT)
+
+if __name__ == '__main__':
+    unittest.main()